@@ -29,9 +29,16 @@ Typical usage:
 	print("%d files processed"%len(report.processed))
 """
 
-from .fileprocessor import FileProcessor
-from .processfunctions import Process, INFILE, OUTFILE
+from .fileprocessor import FileProcessor, CollisionError
+from .processfunctions import Process, PipelineError, INFILE, OUTFILE
 from .namematchers import NameMatcher
-
-__all__ = ['FileProcessor', 'Process', 'INFILE', 'OUTFILE', 'NameMatcher']
+from .schedules import Schedule
+from .throttle import PressureThrottle
+from .sources import ArchiveSource
+from .progress import ProgressReporter, ProgressSummary
+from .filecontext import FileContext
+from .limits import ResourceLimits
+from .productcache import ProductCache
+
+__all__ = ['FileProcessor', 'CollisionError', 'Process', 'PipelineError', 'INFILE', 'OUTFILE', 'NameMatcher', 'Schedule', 'PressureThrottle', 'ArchiveSource', 'ProgressReporter', 'ProgressSummary', 'FileContext', 'ResourceLimits', 'ProductCache']
 
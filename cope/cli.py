@@ -0,0 +1,117 @@
+"""
+The command-line interface to cope, run as `python -m cope`. This loads a
+FileProcessor defined in a Python module or file and runs it, or reports on
+its progress.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os.path
+import sys
+import time
+
+from .fileprocessor import FileProcessor
+
+def load_processor(spec):
+	"""
+	Load a FileProcessor from a specification, which is the path of a Python
+	file or the name of a module, optionally followed by a colon and the name
+	of the object within it (which defaults to 'processor'). The object may
+	be a FileProcessor, or a function returning one.
+	"""
+	(modname, _, attr) = spec.partition(':')
+	if modname.endswith(".py") or os.path.sep in modname:
+		module_spec = importlib.util.spec_from_file_location("cope_config", modname)
+		if module_spec is None:
+			raise ValueError("cannot load %s"%modname)
+		module = importlib.util.module_from_spec(module_spec)
+		module_spec.loader.exec_module(module)
+	else:
+		module = importlib.import_module(modname)
+	obj = getattr(module, attr or 'processor')
+	if not isinstance(obj, FileProcessor):
+		obj = obj()
+	if not isinstance(obj, FileProcessor):
+		raise ValueError("%s is not a FileProcessor"%spec)
+	return obj
+
+def _output(args, values):
+	if args.json:
+		json.dump(values, sys.stdout)
+		sys.stdout.write("\n")
+	else:
+		for (key, value) in values.items():
+			print("%s: %s"%(key.replace("_", " "), value))
+
+def run(args, processor):
+	result = processor.run(
+		dry_run=args.dry_run,
+		max_items=args.max_items,
+		max_dirs=args.max_dirs,
+		limit_to=args.limit_to,
+		resume=args.resume,
+		max_seconds=args.max_seconds,
+		max_bytes=args.max_bytes,
+		verify=args.verify
+	)
+	for (src, error) in result.failed:
+		print("failed: %s: %s"%(src, error), file=sys.stderr)
+	for (src, error) in result.timed_out:
+		print("timed out: %s"%src, file=sys.stderr)
+	_output(args, {field: len(getattr(result, field)) for field in result._fields})
+	return (result.failed or result.timed_out) and 1 or 0
+
+def status(args, processor):
+	repository = processor.metadatarepository
+	values = {
+		"products": repository.product_count(),
+		"last_processed": repository.get_last_processed(),
+	}
+	last_run = repository.get_last_run_stats()
+	if last_run:
+		values.update(("last_run_%s"%k, v) for (k, v) in last_run.items())
+		if not args.json:
+			values["last_run_finished"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_run["finished"]))
+	_output(args, values)
+	return 0
+
+def plan(args, processor):
+	p = processor.plan(limit_to=args.limit_to)
+	values = p._asdict()
+	# estimate the time the backlog will take from the rate of the last run
+	last_run = processor.metadatarepository.get_last_run_stats()
+	if last_run and last_run.get("bytes") and last_run.get("seconds"):
+		values["eta_seconds"] = round(p.pending_bytes * last_run["seconds"] / last_run["bytes"])
+	_output(args, values)
+	return 0
+
+COMMANDS = { 'run': run, 'status': status, 'plan': plan }
+
+def parser():
+	parser = argparse.ArgumentParser(prog="python -m cope", description="Run a cope FileProcessor, or report on its progress")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument("processor", help="the Python file or module defining the FileProcessor, optionally followed by :name (default: processor)")
+	common.add_argument("--json", action="store_true", help="output the results as JSON")
+
+	run = subparsers.add_parser("run", parents=[common], help="process files")
+	run.add_argument("--dry-run", action="store_true", help="determine the files to be processed, without processing them")
+	run.add_argument("--max-items", type=int, help="stop after processing this many files")
+	run.add_argument("--max-dirs", type=int, help="stop after processing files in this many directories")
+	run.add_argument("--max-seconds", type=float, help="start no further files after this many seconds")
+	run.add_argument("--max-bytes", type=int, help="start no further files after processing this many bytes of input")
+	run.add_argument("--limit-to", help="only process files under this directory of the source")
+	run.add_argument("--resume", action="store_true", help="start after the file last processed")
+	run.add_argument("--verify", choices=["exists", "mtime", "size"], help="regenerate outputs which are missing or have changed")
+
+	subparsers.add_parser("status", parents=[common], help="report the files processed, from the processor's records alone")
+
+	plan = subparsers.add_parser("plan", parents=[common], help="estimate the files outstanding, without naming or processing any")
+	plan.add_argument("--limit-to", help="only examine files under this directory of the source")
+	return parser
+
+def main(argv=None):
+	args = parser().parse_args(argv)
+	processor = load_processor(args.processor)
+	return COMMANDS[args.command](args, processor)
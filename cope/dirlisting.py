@@ -0,0 +1,37 @@
+import os
+import os.path
+from collections import OrderedDict
+
+class DirectoryListingCache:
+	"""
+	Answers questions about the files under a directory from listings of
+	their parent directories, so that examining many files in one directory
+	costs a single listing rather than a stat of each. The listings of the
+	most recently used directories are kept, up to a limit.
+	"""
+	def __init__(self, basepath, size=64):
+		self.basepath = basepath
+		self.size = size
+		self.listings = OrderedDict()
+
+	def _listing(self, reldir):
+		listing = self.listings.get(reldir)
+		if listing is not None:
+			self.listings.move_to_end(reldir)
+			return listing
+		try:
+			listing = {e.name: e for e in os.scandir(os.path.join(self.basepath, reldir))}
+		except (FileNotFoundError, NotADirectoryError):
+			listing = {}
+		self.listings[reldir] = listing
+		if len(self.listings) > self.size:
+			self.listings.popitem(last=False)
+		return listing
+
+	def entry(self, relpath):
+		"Return the os.DirEntry for a relative path, or None if nothing exists there"
+		(reldir, name) = os.path.split(relpath)
+		return self._listing(reldir).get(name)
+
+	def exists(self, relpath):
+		return self.entry(relpath) is not None
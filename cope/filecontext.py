@@ -0,0 +1,55 @@
+import hashlib
+
+class FileContext:
+	"""
+	Information about an input file, gathered on demand and shared between the
+	functions handling it (includefile, destname and process), so that
+	inspecting the file need only be done once. A FileContext is created for
+	each input file, and discarded once the file has been handled.
+
+	Its attributes are:
+	- relpath: the path of the file relative to the source
+	- path: the path of the file in the filesystem
+	- stat: the file's status, as returned by os.stat
+	- header: the first bytes of the file (up to header_size), read when first asked for
+	- digest: the SHA-256 digest of the file's content, as a hexadecimal string, computed when first asked for
+	- data: a dictionary in which the functions handling the file may keep anything else they find out about it
+	"""
+	def __init__(self, source, relpath, header_size=4096):
+		self.source = source
+		self.relpath = relpath
+		self.header_size = header_size
+		self.data = {}
+		self._path = None
+		self._stat = None
+		self._header = None
+		self._digest = None
+
+	@property
+	def path(self):
+		if self._path is None:
+			self._path = self.source.path(self.relpath)
+		return self._path
+
+	@property
+	def stat(self):
+		if self._stat is None:
+			self._stat = self.source.stat(self.relpath)
+		return self._stat
+
+	@property
+	def header(self):
+		if self._header is None:
+			with self.source.open(self.relpath) as f:
+				self._header = f.read(self.header_size)
+		return self._header
+
+	@property
+	def digest(self):
+		if self._digest is None:
+			h = hashlib.sha256()
+			with self.source.open(self.relpath) as f:
+				for block in iter(lambda: f.read(1<<20), b''):
+					h.update(block)
+			self._digest = h.hexdigest()
+		return self._digest
@@ -2,130 +2,537 @@ import os
 import os.path
 import enum
 import time
+import itertools
+import subprocess
 from collections import namedtuple
 from inspect import signature
 from .metadatarepository import MetadataRepository
 from .iterators.directorytree import DirectoryTreeIterator
+from .publisher import OutputPublisher
+from .sources import FilesystemSource
+from .dirlisting import DirectoryListingCache
+from .filecontext import FileContext
+from .watchdog import call_with_timeout
+
+class CollisionError(Exception):
+	"""
+	Raised when an input file is named with the same output path as another
+	input file, and the processor's collision policy is 'fail'. src is the
+	input file, dest the output path and other the other input file. The
+	run stops at that file, and result holds the FileProcessor.Result of
+	the files handled before it.
+	"""
+	def __init__(self, src, dest, other, result=None):
+		Exception.__init__(self, "%s and %s both have the output %s"%(src, other, dest))
+		self.src = src
+		self.dest = dest
+		self.other = other
+		self.result = result
 
 def argcount(fn):
-	"Return how many arguments a function accepts"
-	return len(signature(fn).parameters)
+	"Return how many positional arguments a function accepts, which is unbounded (infinite) if it takes *args"
+	parameters = signature(fn).parameters.values()
+	if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+		return float('inf')
+	return len([p for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)])
 
 class FileProcessor:
 	"""
 	The engine for automatically selecting suitable files from an input directory, and applying a process to derive output files from them in an output directory. 
 	"""
-	Result = namedtuple('Result', ['processed', 'already_present', 'unnameable', 'failed'])
+	Plan = namedtuple('Plan', ['pending', 'pending_bytes', 'already_present'])
+
+	Result = namedtuple('Result', ['processed', 'already_present', 'unnameable', 'failed', 'timed_out', 'collisions', 'moved'])
 
 	class ProgressType(enum.Enum):
 		PROCESSED = 1
 		ALREADY_PRESENT = 2
 		UNNAMEABLE = 3
 		ERROR = 4
+		TIMED_OUT = 5
+		COLLISION = 6
+		MOVED = 7
 
-	def __init__(self, srcpath, destpath, process, destname=None, iterator=None, includename=None, includefile=None, onprogress=None):
+	COLLISION_POLICIES = ('overwrite', 'fail', 'keep-first', 'suffix')
+
+	MOVE_POLICIES = (None, 'keep', 'rename', 'link')
+
+	def __init__(self, srcpath, destpath, process, destname=None, iterator=None, includename=None, includefile=None, onprogress=None, atomic=False, commit_every=100, schedule=None, throttle=None, provenance='sqlite', context=False, header_size=4096, includenames=None, includefiles=None, destnames=None, timeout=None, limits=None, cache=None, collisions='overwrite', moves=None):
 		"""
 		Create a FileProcessor object. The arguments are:
-		- srcpath: the tree containing files to traverse and process
+		- srcpath: the tree containing files to traverse and process, or a source object (such as an ArchiveSource) providing input files
 		- destpath: the tree to place output (and working metadata) in
 		- process: a function, given the absolute path of an input file and that of its output, carries out the process of generating the output from the input.
 		- destname: a function that takes two arguments (the path relative to the source tree of a file and (optionally) its absolute path in the filesystem) and returns its relative path for its product, or None if the file is to be omitted
 		- iterator: a function which takes a path and returns a generator of relative paths of input files within the source directory
 		- includename: an optional function determining whether a file should be included; this accepts the file's relative path and should work solely by inspecting its name
 		- includefile: an optional function determining whether a file should be included; this accepts the file's full path, and should be used for checks that need to inspect the file or its properties
-		- onprogress: an optional function which, if provided, is called after each file is handled (one way or another), with a ProgressType, a source relative path and (where valid) a destination relative path. This is intended to be used for progress indicators or similar.
+		- onprogress: an optional function which, if provided, is called after each file is handled (one way or another), with a ProgressType, a source relative path, (where valid) a destination relative path and, if it accepts a fourth argument, the size of the source file. This is intended to be used for progress indicators or similar; a ProgressReporter may be used to keep reporting off the processing loop.
+		- atomic: if true, process writes each output at a temporary path, and outputs are renamed into place and synced to disk in batches, together with their provenance records, so that a crash never leaves a truncated output in place.
+		- commit_every: in atomic mode, the number of outputs published in each batch.
+		- throttle: an optional object whose wait() method is called before each file is processed, which may hold processing back while the host is busy; see PressureThrottle.
+		- schedule: an optional scheduling policy (such as those under Schedule), determining the order in which files are processed; if omitted, they are processed in the order the iterator yields them.
+		- provenance: how the records of files processed are kept: 'sqlite' (the default), in an SQLite database; 'compact', in an SQLite database in a more compact form, for large trees (existing 'sqlite' records are converted to this when first opened); or 'log', in an append-only log, for destinations where SQLite's locking is slow or unreliable
+		- context: if true, a FileContext for each input file is passed as an additional argument to includefile, destname and process, if they accept one (i.e., includefile(path, context), destname(relpath, path, context) and process(src, dest, context)). This holds the file's status, its first header_size bytes and a dictionary for the functions to share anything else they find out about it, so that each file need only be inspected once.
+		- header_size: the number of bytes of each file's header to provide in its FileContext
+		- includenames, includefiles, destnames: optional batch forms of includename, includefile and destname, which are called once for each directory's files rather than once per file, allowing per-call overheads to be amortised and filtering to be vectorised. includenames is called with a list of the relative paths of the files in a directory, and includefiles with a list of their full paths; each returns those of the paths which are to be included. destnames is called with a list of the relative paths of the files not yet processed, and returns a list of the destination names for them (or None for those to be omitted), in the same order; a ValueError is raised if the lists differ in length. These are only available for sources which are directory trees.
+		- timeout: if specified, process is called in a child process for each file, which is killed (together with any processes it started) if it runs for longer than this many seconds. Files for which this happens are reported as timed out, and processing continues with the next file. The child is forked, so process must not use anything that other threads (such as a ProgressReporter's) may hold locks on; see call_with_timeout.
+		- limits: if specified, a ResourceLimits; process is called in a child process for each file, to which these priorities and resource limits are applied
+		- collisions: what to do when an input file is named with the same output path as another input file (either earlier in the same run, or recorded as its output in an earlier run): 'overwrite' (the default) processes it regardless, replacing the other's output; 'fail' stops the run, once the work done so far has been recorded, and raises a CollisionError; 'keep-first' leaves the output to the input which had it first; 'suffix' names the output differently, by adding a numeric suffix to its name (not used by any other input, or by any file not recorded as this input's output). In each case, the collision is reported in the result; it is reported to onprogress as a COLLISION only if the file is not processed.
+		- moves: if specified, input files which have been moved or renamed since they were processed are recognised by their identity (device, inode, size and modification time), and their provenance records updated, rather than their being processed again. If 'keep', their outputs are left where they are; if 'rename', they are renamed to the new destination names of the input files; if 'link', they are hard-linked at those names, leaving the old ones in place, still recorded as the outputs of the vanished inputs, so that find_orphans reports them; they are to be deleted by hand once no longer wanted, and their records with purge_orphans. Moves can only be recognised where the source is a directory tree.
+		- cache: an optional ProductCache, which may be shared with other FileProcessors; where an output has already been generated for an input with the same content, it is taken from the cache rather than generated again
 		"""
 		self.srcpath = srcpath
 		self.destpath = destpath
 		self.includename = includename and includename or (lambda n: True)
-		self.includefile = includefile and includefile or (lambda n: True)
+		self.includefile = includefile
 		self.destname = destname and destname or (lambda name: name)
 		self.process = process
+		self.context = context
+		self.header_size = header_size
+		# the number of arguments each function is to be called with; without
+		# a context, includefile and process are always called with all of
+		# theirs, as they always have been
+		self._includefile_args = includefile and (context and min(argcount(includefile), 2) or 1)
+		self._destname_args = min(argcount(self.destname), context and 3 or 2)
+		streaming = getattr(process, 'streaming', None)
+		self._process_args = context and min(argcount(streaming or process), 3) or 2
 		self.iterator = iterator and iterator or DirectoryTreeIterator()
+		self.schedule = schedule
+		self.throttle = throttle
+		if schedule:
+			self.iterator = schedule(self.iterator)
+		self.source = isinstance(srcpath, str) and FilesystemSource(srcpath, self.iterator) or srcpath
+		self.includenames = includenames
+		self.includefiles = includefiles
+		self.destnames = destnames
+		self.timeout = timeout
+		self.limits = limits
+		self.cache = cache
+		if collisions not in FileProcessor.COLLISION_POLICIES:
+			raise ValueError("unknown collision policy: %s"%collisions)
+		self.collisions = collisions
+		if moves not in FileProcessor.MOVE_POLICIES:
+			raise ValueError("unknown move policy: %s"%moves)
+		self.moves = moves
+		# the files of a directory are only examined once all of them have been
+		# listed, by which time a streaming source (such as an archive) has
+		# moved on past them
+		if (includenames or includefiles or destnames) and not isinstance(self.source, FilesystemSource):
+			raise ValueError("includenames, includefiles and destnames can only be used with a directory tree as a source")
 		# a method to call once any file has been processed/skipped, called with a ProgressType enum, source path and destination path or None
 		self.onprogress = onprogress
-		self.metadatarepository = MetadataRepository(destpath)
+		# one taking *args is only given the original three arguments, as it always has been
+		self._onprogress_takes_size = onprogress and 4 <= argcount(onprogress) < float('inf')
+		self.metadatarepository = MetadataRepository(destpath, provenance=provenance)
+		self.publisher = atomic and OutputPublisher(destpath, self.metadatarepository, commit_every) or None
+
+	def _call_onprogress(self, progresstype, rsrcpath, result, size):
+		if self._onprogress_takes_size:
+			self.onprogress(progresstype, rsrcpath, result, size)
+		elif self.onprogress:
+			self.onprogress(progresstype, rsrcpath, result)
+
+	# the functions handling files are called with the arguments they accept;
+	# the path of a file is only asked for if needed, as it may be costly to
+	# provide (i.e., by extracting the file from an archive)
+
+	def _includes_file(self, ctx):
+		if not self.includefile:
+			return True
+		return self.includefile(*(ctx.path, ctx)[:self._includefile_args])
+
+	def _name_for(self, ctx):
+		if self._destname_args < 2:
+			return self.destname(ctx.relpath)
+		return self.destname(*(ctx.relpath, ctx.path, ctx)[:self._destname_args])
+
+	def _generate(self, ctx, ftargetpath):
+		streaming = getattr(self.process, 'streaming', None)
+		if streaming:
+			# the context's own source, which in a child process is the extracted copy of an archive member
+			with ctx.source.open(ctx.relpath) as fi:
+				streaming(*(fi, ftargetpath, ctx)[:self._process_args])
+		else:
+			self.process(*(ctx.path, ftargetpath, ctx)[:self._process_args])
+
+	def _generate_output(self, ctx, ftargetpath):
+		if self.cache and os.path.lexists(ftargetpath):
+			# an existing output may be a hard link to a cached one, so must not be written over
+			os.unlink(ftargetpath)
+		if self.timeout or self.limits:
+			self._generate_in_child(ctx, ftargetpath)
+		else:
+			self._generate(ctx, ftargetpath)
+		if self.cache:
+			self.cache.store(ctx.digest, ftargetpath)
+
+	def _generate_in_child(self, ctx, ftargetpath):
+		if not isinstance(self.source, FilesystemSource):
+			# other sources may not be readable from another process, so the
+			# input is made available as a file first
+			source = FilesystemSource(os.path.dirname(ctx.path), None)
+			ctx = FileContext(source, os.path.basename(ctx.path), self.header_size)
+		call_with_timeout(self._generate, (ctx, ftargetpath), self.timeout, self.limits)
 
-	def _call_onprogress(self, *args):
-		if self.onprogress:
-			self.onprogress(*args)
+	def _batched(self, paths, pending=lambda p: True):
+		"""
+		Apply the batch forms of the filtering functions to the paths given,
+		a directory at a time, yielding a (path, naming function) tuple for
+		each path included, where the naming function returns the destination
+		name for a FileContext. Names are only generated for the paths for
+		which pending returns true (i.e., those not yet processed).
+		"""
+		if not (self.includenames or self.includefiles or self.destnames):
+			for rsrcpath in paths:
+				yield (rsrcpath, self._name_for)
+			return
+		for (reldir, group) in itertools.groupby(paths, os.path.dirname):
+			batch = list(group)
+			if self.includenames:
+				batch = FileProcessor._filter(self.includenames, batch)
+			if self.includefiles:
+				included = set(self.includefiles([self.source.path(p) for p in batch]))
+				batch = [p for p in batch if self.source.path(p) in included]
+			if self.destnames:
+				# names are only generated if any file in the directory needs one
+				names = {}
+				def name_for(ctx, batch=batch, names=names):
+					if not names:
+						unnamed = [p for p in batch if p == ctx.relpath or pending(p)]
+						destnames = self.destnames(unnamed)
+						if len(destnames) != len(unnamed):
+							raise ValueError("destnames returned %d names for %d paths"%(len(destnames), len(unnamed)))
+						names.update(zip(unnamed, destnames))
+					return names.get(ctx.relpath)
+			else:
+				name_for = self._name_for
+			for rsrcpath in batch:
+				yield (rsrcpath, name_for)
+
+	@staticmethod
+	def _filter(includenames, batch):
+		"Return the paths in a batch which includenames includes, in their original order"
+		included = set(includenames(batch))
+		return [p for p in batch if p in included]
 
-	def run(self, dry_run=False, max_items=None, max_dirs=None, limit_to=None, resume=False):
+	def plan(self, limit_to=None):
+		"""
+		Estimate the work outstanding, by examining the input files' names and
+		status and the records of files already processed, without calling
+		includefile, destname or process. Files which includefile would exclude
+		are counted as pending, so this may overestimate the work outstanding.
+
+		Returns a Plan namedtuple with the following fields:
+		 - pending: the number of files not yet processed
+		 - pending_bytes: their total size
+		 - already_present: the number of files already processed
+		"""
+		pending, pending_bytes, already_present = 0, 0, 0
+		paths = limit_to is not None and self.source.iterate(limit_to=limit_to) or self.source.iterate()
+		paths = (p for p in paths if self.includename(p))
+		if self.includenames:
+			# this lists each directory before examining its files, which only a directory tree allows
+			paths = (p for (reldir, group) in itertools.groupby(paths, os.path.dirname) for p in FileProcessor._filter(self.includenames, list(group)))
+		# each file is examined as it is yielded, while a streaming source (such as an archive) is still at it
+		for rsrcpath in paths:
+			src_stat = self.source.stat(rsrcpath)
+			if src_stat is None:
+				continue
+			if self.metadatarepository.check_for_product(rsrcpath, int(src_stat.st_mtime*1000000)):
+				already_present += 1
+			else:
+				pending += 1
+				pending_bytes += src_stat.st_size
+		return FileProcessor.Plan(pending=pending, pending_bytes=pending_bytes, already_present=already_present)
+
+	def _claimant(self, rdestpath, rsrcpath, claimed):
+		"""
+		Return the other input file which has the output path given, either in
+		this run (according to claimed, a dictionary of the output paths
+		produced so far) or according to the records of previous runs, or None
+		"""
+		other = claimed.get(rdestpath)
+		if other is None:
+			record = self.metadatarepository.lookup_output(rdestpath)
+			other = record and record.inpath
+			# an input which no longer exists no longer needs its output; this
+			# can only be known where the source is a directory tree
+			if other and isinstance(self.source, FilesystemSource) and self.source.stat(other) is None:
+				other = None
+		return other != rsrcpath and other or None
+
+	def _disambiguate(self, rdestpath, rsrcpath, claimed):
+		"""
+		Return the first output path with a numeric suffix added to rdestpath
+		which no other input file has, and at which there is no file other
+		than one recorded as this input file's output
+		"""
+		(root, ext) = os.path.splitext(rdestpath)
+		for n in itertools.count(1):
+			candidate = "%s-%d%s"%(root, n, ext)
+			if self._claimant(candidate, rsrcpath, claimed):
+				continue
+			if os.path.lexists(os.path.join(self.destpath, candidate)):
+				record = self.metadatarepository.lookup_output(candidate)
+				if not (record and record.inpath == rsrcpath):
+					continue
+			return candidate
+
+	@staticmethod
+	def _identity(st):
+		"Return the identity of a file by which it may be recognised if moved, or None if the source provides none"
+		if getattr(st, 'st_ino', None) is None:
+			return None
+		return (st.st_dev, st.st_ino, st.st_size)
+
+	def _moved_from(self, identity, mtime):
+		"Return the provenance record of a file with the identity given whose input has since gone from where it was, or None"
+		if not (self.moves and identity and isinstance(self.source, FilesystemSource)):
+			return None
+		for record in self.metadatarepository.lookup_moved_product(identity, mtime):
+			if self.source.stat(record.inpath) is None:
+				return record
+		return None
+
+	def _move_output(self, record, rsrcpath, src_mtime, identity, rdestpath):
+		"Move (or link) the output for a moved input file to its new destination and update its record, returning whether this could be done"
+		fdestpath = os.path.join(self.destpath, rdestpath)
+		try:
+			if rdestpath != record.outpath:
+				fprevpath = os.path.join(self.destpath, record.outpath)
+				os.makedirs(os.path.dirname(fdestpath), exist_ok=True)
+				if self.moves == 'rename':
+					os.replace(fprevpath, fdestpath)
+				else:
+					if os.path.lexists(fdestpath):
+						os.unlink(fdestpath)
+					os.link(fprevpath, fdestpath)
+			dest_stat = os.stat(fdestpath)
+		except OSError:
+			return False
+		self.metadatarepository.record_product(rsrcpath, src_mtime, rdestpath, int(dest_stat.st_mtime*1000000), record.opname, outsize=dest_stat.st_size, identity=identity)
+		# a linked output's old name stays recorded, as the output of an input
+		# which no longer exists, so that find_orphans reports it
+		if rdestpath != record.outpath and self.moves == 'rename':
+			self.metadatarepository.delete_products([record.outpath])
+		return True
+
+	@staticmethod
+	def _output_intact(outputs, record, verify):
+		"Return whether a recorded output is still as it was recorded, to the degree of verification specified"
+		entry = outputs.entry(record.outpath)
+		if entry is None:
+			return False
+		if verify == 'exists':
+			return True
+		st = entry.stat()
+		if record.outmtime is not None and int(st.st_mtime*1000000) != record.outmtime:
+			return False
+		if verify == 'size' and record.outsize is not None and st.st_size != record.outsize:
+			return False
+		return True
+
+	def _damaged_outputs(self, verify, limit_to):
+		"""
+		Return the set of the paths of the recorded outputs which are not as
+		recorded, checking them in order of their paths, so that each
+		output directory is listed only once
+		"""
+		outputs = DirectoryListingCache(self.destpath)
+		records = self.metadatarepository.provenance_records(inprefix=limit_to, order='outpath')
+		return set(r.outpath for r in records if not FileProcessor._output_intact(outputs, r, verify))
+
+	def run(self, dry_run=False, max_items=None, max_dirs=None, limit_to=None, resume=False, max_seconds=None, max_bytes=None, verify=None):
 		"""Run the process. 
 
 		If dry_run is true, no actual processing is done and the database is not updated, but everything else is handled as if it were live.
-		If max_items is specified, the function will exit after that number of items have been processed.
-		If max_dirs is specified, the function will exit after items are processed in that number of directories.
+		If max_items is specified, the function will exit after that number of items have been processed (or, with moves, moved).
+		If max_dirs is specified, the function will exit after items are processed (or moved) in that number of directories.
+		If max_seconds is specified, no further items will be started once the run has taken that many seconds.
+		If max_bytes is specified, no further items will be started once input files totalling that many bytes have been processed.
 		If resume is set to True, start from the file returned by the iterator immediately after
-		the last file processed.
+		the last file processed. This cannot be combined with a scheduling policy.
+		If verify is specified, the outputs recorded for files already processed are checked, and the files are processed again if their outputs are not as recorded. It may be 'exists' (checking that the output exists), 'mtime' (also checking its modification time) or 'size' (also checking its size). The outputs are all checked before processing starts, a directory at a time, against listings of the directories, to avoid examining each separately where possible.
 
 		Returns a namedtuple containing the following fields, with all paths being relative to base directories:
 		 - processed: list of (source, destination) tuples for all files that were or would have been processed
 		 - already_present: list of (source, destination) tuples for files that had been handled before, and thus were omitted this time 
 		 - unnameable: list of source tuples for files for which the destname operation failed to return a name.
+		 - failed: list of (source, error) tuples for files whose processing raised an error
+		 - timed_out: list of (source, error) tuples for files whose processing was stopped for taking too long
+		 - moved: list of (source, destination, previous source) tuples for files recognised as having been moved since they were processed, whose outputs were kept rather than generated again
+		 - collisions: list of (source, destination, other source) tuples for files named with the same destination as another file, which are handled according to the collision policy
 		"""
 
-		processed, already_present, unnameable, failed = [],[],[],[]
+		if resume and self.schedule:
+			raise ValueError("resume cannot be used with a scheduling policy")
+		if verify not in (None, 'exists', 'mtime', 'size'):
+			raise ValueError("unknown verification mode: %s"%verify)
+
+		processed, already_present, unnameable, failed, timed_out, collisions, moved = [],[],[],[],[],[],[]
+		# the files skipped for colliding, and the CollisionError stopping the run, if any
+		skipped = 0
+		collision_error = None
+		# the input file each output path has been produced from in this run
+		claimed = {}
 		last_dir = None
+		started = time.monotonic()
+		bytes_processed = 0
 		start_after = resume and self.metadatarepository.get_last_processed()
+		damaged = verify and self._damaged_outputs(verify, limit_to)
+
+		def within_dir_limit(rsrcdir):
+			"Count the directory of a file about to be processed or moved against max_dirs, returning whether it is within it"
+			nonlocal max_dirs, last_dir
+			if max_dirs is not None and rsrcdir != last_dir:
+				if max_dirs == 0:
+					return False
+				max_dirs -= 1
+				last_dir = rsrcdir
+			return True
+
+		def pending(rsrcpath):
+			"Return whether a file is yet to be processed, or to be processed again, so needs naming"
+			st = self.source.stat(rsrcpath)
+			prev = st and self.metadatarepository.lookup_product(rsrcpath, int(st.st_mtime*1000000))
+			return not prev or bool(verify and prev.outpath in damaged)
+
+		if hasattr(self.onprogress, 'begin'):
+			last_stats = self.metadatarepository.get_last_run_stats()
+			self.onprogress.begin(last_stats and last_stats.get('examined'))
 
 		# TODO: reject mutually exclusive parameters (i.e., resume and limit_to) specified together
 		if start_after:
-			iter = self.iterator(self.srcpath, start=start_after)
+			iter = self.source.iterate(start=start_after)
 			next(iter)
 		elif limit_to is not None:
-			iter = self.iterator(self.srcpath, limit_to=limit_to)
+			iter = self.source.iterate(limit_to=limit_to)
 		else:
-			iter = self.iterator(self.srcpath)
+			iter = self.source.iterate()
 
-		for rsrcpath in iter:
-			rsrcdir = os.path.dirname(rsrcpath)
-			if max_items == 0:
-				break
-			if not self.includename(rsrcpath):
-				continue
-			fsrcpath = os.path.join(self.srcpath, rsrcpath)
-			if not os.path.exists(fsrcpath):
-				continue
-			if not self.includefile(fsrcpath):
-				continue
+		if self.publisher and not dry_run:
+			self.publisher.begin()
+		try:
+			for (rsrcpath, name_for) in self._batched(iter, pending):
+				rsrcdir = os.path.dirname(rsrcpath)
+				if max_items == 0:
+					break
+				if max_seconds is not None and time.monotonic() - started >= max_seconds:
+					break
+				if max_bytes is not None and bytes_processed >= max_bytes:
+					break
+				if not self.includename(rsrcpath):
+					continue
+				ctx = FileContext(self.source, rsrcpath, self.header_size)
+				src_stat = ctx.stat
+				if src_stat is None:
+					continue
+				if not self._includes_file(ctx):
+					continue
 
-			# we store the timestamp as an int for ease of comparison, but 
-			# convert it to microseconds, as modern OSes support 
- 			# sub-millisecond timestamps
-			src_mtime = int(os.path.getmtime(fsrcpath)*1000000)
-			prevdest = self.metadatarepository.check_for_product(rsrcpath, src_mtime)
-			if prevdest:	
-				already_present.append((rsrcpath, prevdest))
-				self._call_onprogress(FileProcessor.ProgressType.ALREADY_PRESENT, rsrcpath, prevdest)
-				continue
-			if argcount(self.destname)>=2:
-				rdestpath = self.destname(rsrcpath, fsrcpath)
-			else:
-				rdestpath = self.destname(rsrcpath)
-			if not rdestpath:
-				unnameable.append(rsrcpath)
-				self._call_onprogress(FileProcessor.ProgressType.UNNAMEABLE, rsrcpath, None)
-				continue
-			if max_dirs is not None:
-				if rsrcdir != last_dir:
-					if max_dirs == 0:
+				# we store the timestamp as an int for ease of comparison, but 
+				# convert it to microseconds, as modern OSes support 
+				# sub-millisecond timestamps
+				src_mtime = int(src_stat.st_mtime*1000000)
+				identity = FileProcessor._identity(src_stat)
+				prev = self.metadatarepository.lookup_product(rsrcpath, src_mtime)
+				if prev and (not verify or prev.outpath not in damaged):
+					if identity and prev.inino is None and not dry_run:
+						# records made before identities were kept gain them, so that their files' moves can be recognised
+						self.metadatarepository.record_product_identity(prev.outpath, identity, commit=False)
+					already_present.append((rsrcpath, prev.outpath))
+					claimed[prev.outpath] = rsrcpath
+					self._call_onprogress(FileProcessor.ProgressType.ALREADY_PRESENT, rsrcpath, prev.outpath, src_stat.st_size)
+					continue
+				rdestpath = name_for(ctx)
+				if not rdestpath:
+					unnameable.append(rsrcpath)
+					self._call_onprogress(FileProcessor.ProgressType.UNNAMEABLE, rsrcpath, None, src_stat.st_size)
+					continue
+				moved_from = prev is None and self._moved_from(identity, src_mtime)
+				if moved_from:
+					target = self.moves == 'keep' and moved_from.outpath or rdestpath
+					if not self._claimant(target, rsrcpath, claimed):
+						if not within_dir_limit(rsrcdir):
+							break
+						if dry_run or self._move_output(moved_from, rsrcpath, src_mtime, identity, target):
+							moved.append((rsrcpath, target, moved_from.inpath))
+							claimed[target] = rsrcpath
+							self._call_onprogress(FileProcessor.ProgressType.MOVED, rsrcpath, target, src_stat.st_size)
+							if max_items is not None:
+								max_items = max_items - 1
+							continue
+				other = self._claimant(rdestpath, rsrcpath, claimed)
+				if other:
+					collisions.append((rsrcpath, rdestpath, other))
+					# a file which is processed regardless is reported as processed instead
+					if self.collisions in ('fail', 'keep-first'):
+						self._call_onprogress(FileProcessor.ProgressType.COLLISION, rsrcpath, rdestpath, src_stat.st_size)
+					if self.collisions == 'fail':
+						collision_error = CollisionError(rsrcpath, rdestpath, other)
 						break
-					max_dirs -= 1
-					last_dir = rsrcdir
+					elif self.collisions == 'keep-first':
+						skipped += 1
+						continue
+					elif self.collisions == 'suffix':
+						rdestpath = self._disambiguate(rdestpath, rsrcpath, claimed)
+				claimed[rdestpath] = rsrcpath
+				if not within_dir_limit(rsrcdir):
+					break
+				if not dry_run:
+					if self.throttle:
+						self.throttle.wait()
+					fdestpath = os.path.join(self.destpath, rdestpath)
+					os.makedirs(os.path.dirname(fdestpath), exist_ok=True)
+					ftargetpath = self.publisher and self.publisher.temp_path_for(fdestpath) or fdestpath
+					try:
+						if not (self.cache and self.cache.fetch(ctx.digest, ftargetpath)):
+							self._generate_output(ctx, ftargetpath)
+					except (TimeoutError, subprocess.TimeoutExpired) as e:
+						if self.publisher:
+							self.publisher.discard(ftargetpath)
+						timed_out.append((rsrcpath, e))
+						self._call_onprogress(FileProcessor.ProgressType.TIMED_OUT, rsrcpath, e, src_stat.st_size)
+						continue
+					except Exception as e:
+						if self.publisher:
+							self.publisher.discard(ftargetpath)
+						failed.append((rsrcpath, e))
+						self._call_onprogress(FileProcessor.ProgressType.ERROR, rsrcpath, e, src_stat.st_size)
+						continue
+					if self.publisher:
+						self.publisher.stage(ftargetpath, fdestpath, rsrcpath, src_mtime, rdestpath, identity=identity)
+					else:
+						dest_stat = os.stat(fdestpath)
+						self.metadatarepository.record_product(rsrcpath, src_mtime, rdestpath, int(dest_stat.st_mtime*1000000), outsize=dest_stat.st_size, identity=identity)
+				processed.append((rsrcpath, rdestpath))
+				bytes_processed += src_stat.st_size
+				self._call_onprogress(FileProcessor.ProgressType.PROCESSED, rsrcpath, rdestpath, src_stat.st_size)
+				if max_items is not None:
+					max_items = max_items - 1
+		finally:
 			if not dry_run:
-				fdestpath = os.path.join(self.destpath, rdestpath)
-				os.makedirs(os.path.dirname(fdestpath), exist_ok=True)
+				self.metadatarepository.commit()
+			if self.publisher and not dry_run:
 				try:
-					self.process(fsrcpath, fdestpath)
-				except Exception as e:
-					failed.append((rsrcpath, e))
-					self._call_onprogress(FileProcessor.ProgressType.ERROR, rsrcpath, e)
-					continue
-				self.metadatarepository.record_product(rsrcpath, src_mtime, rdestpath, int(os.path.getmtime(fdestpath)*1000000))
-			processed.append((rsrcpath, rdestpath))
-			self._call_onprogress(FileProcessor.ProgressType.PROCESSED, rsrcpath, rdestpath)
-			if max_items is not None:
-				max_items = max_items - 1
+					self.publisher.commit()
+				finally:
+					self.publisher.end()
+			if hasattr(self.onprogress, 'flush'):
+				self.onprogress.flush()
+
+		if not dry_run:
+			self.metadatarepository.save_run_stats({
+				"examined": len(processed) + len(already_present) + len(unnameable) + len(failed) + len(timed_out) + len(moved) + skipped,
+				"processed": len(processed),
+				"bytes": bytes_processed,
+				"seconds": time.monotonic() - started,
+				"finished": time.time()
+			})
 
-		return FileProcessor.Result(processed=processed, already_present=already_present, unnameable=unnameable, failed=failed)
+		result = FileProcessor.Result(processed=processed, already_present=already_present, unnameable=unnameable, failed=failed, timed_out=timed_out, collisions=collisions, moved=moved)
+		if collision_error:
+			collision_error.result = result
+			raise collision_error
+		return result
@@ -3,6 +3,7 @@
 
 import os
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 
 def DirectoryTreeIterator(include_dir=lambda d:True):
 	""" """
@@ -46,4 +47,95 @@ def DirectoryTreeIterator(include_dir=lambda d:True):
 			elif os.path.isfile(itempath):
 				yield os.path.normpath(relitempath)
 
-	return iter
\ No newline at end of file
+	return iter
+
+
+def _list_dir(path):
+	"List a directory, returning a sorted list of (name, is_dir, is_file) tuples"
+	entries = [(e.name, e.is_dir(), e.is_file()) for e in os.scandir(path)]
+	entries.sort()
+	return entries
+
+
+def ConcurrentDirectoryTreeIterator(include_dir=lambda d:True, concurrency=8, prefetch=None):
+	"""
+	A variant of DirectoryTreeIterator which lists directories ahead of the
+	traversal in a bounded pool of threads, whilst yielding exactly the same
+	paths in exactly the same order. This is useful on high-latency
+	filesystems (such as NFS or CIFS mounts), where a serial walk spends most
+	of its time waiting for directory listings.
+
+	Arguments:
+	- include_dir: as for DirectoryTreeIterator
+	- concurrency: the number of threads listing directories at once
+	- prefetch: the maximum number of directory listings to have requested
+	  ahead of the traversal at any time; this bounds the memory used. It
+	  defaults to four times the concurrency.
+	"""
+	prefetch = prefetch or concurrency*4
+
+	def iter(path, start=None, stop=None, limit_to=None):
+		"""
+		iterate under a directory, yielding a succession of relative paths;
+		the arguments are as for DirectoryTreeIterator
+		"""
+		if limit_to:
+			start = limit_to
+			stop = limit_to
+		if type(start) == str:
+			start = start.split('/')
+		if type(stop) == str:
+			stop = stop.split('/')
+		pool = ThreadPoolExecutor(max_workers=concurrency)
+		# the number of listings requested but not yet consumed
+		inflight = [0]
+
+		def walk(dirpath, reldir, start, stop, listing):
+			if listing is None:
+				entries = _list_dir(dirpath)
+			else:
+				entries = listing.result()
+				inflight[0] -= 1
+			items = []
+			for (item, is_dir, is_file) in entries:
+				if start and item < start[0]:
+					continue
+				if stop and item > stop[0]:
+					continue
+				relitempath = reldir and os.path.join(reldir, item) or item
+				if is_dir:
+					if include_dir(relitempath):
+						items.append((item, relitempath, True))
+				elif is_file:
+					items.append((item, relitempath, False))
+
+			# request listings of the subdirectories in the order they will be
+			# visited, as far ahead as the prefetch limit allows
+			subdirs = [i for i in items if i[2]]
+			listings = {}
+			queued = 0
+			for (item, relitempath, is_dir) in items:
+				if not is_dir:
+					yield os.path.normpath(relitempath)
+					continue
+				while queued < len(subdirs) and inflight[0] < prefetch:
+					subdir = subdirs[queued][0]
+					listings[subdir] = pool.submit(_list_dir, os.path.join(dirpath, subdir))
+					inflight[0] += 1
+					queued += 1
+				for i in walk(
+					os.path.join(dirpath, item),
+					relitempath,
+					(start and item == start[0]) and start[1:] or None,
+					(stop and item == stop[0]) and stop[1:] or None,
+					listings.pop(item, None)
+				):
+					yield i
+
+		try:
+			for i in walk(path, '', start, stop, None):
+				yield i
+		finally:
+			pool.shutdown(wait=False)
+
+	return iter
@@ -1,27 +1,70 @@
-
 import os
-import itertools
+import os.path
+
+def _walk_key(path, segments):
+	"""
+	Return a key giving the position of a path (as a list of segments) in the
+	order in which TreeWalkIterator yields files, in which the files in a
+	directory come before its subdirectories
+	"""
+	isdir = os.path.isdir(os.path.join(path, *segments))
+	return [(1, s) for s in segments[:-1]] + [(isdir and 1 or 0, segments[-1])]
 
 def TreeWalkIterator(include_dir=lambda d:True, max_dirs=None):
 	"""
-	An iterator that walks a directory tree and yields relative subpaths.
+	An iterator that walks a directory tree and yields relative subpaths. The
+	files in each directory are yielded in sorted order, before those in its
+	subdirectories, which are visited in sorted order.
 
 	Arguments:
-	- include_dir: an optional lambda function called with the relative path of a directory, returning 
-	  a truth value. If false, the directory will not be processed.
-	- max_dirs: the maximum number of directories to process in this run. This counts all directories
-	  visited, regardless of whether any action is taken.
+	- include_dir: an optional lambda function called with the relative path of a directory, returning
+	  a truth value. If false, the directory and everything under it will not be processed; it is
+	  not descended into.
+	- max_dirs: the maximum number of directories to process in this run. This counts only directories
+	  from which files are yielded.
 	"""
-	def iter(path):
-		generator = os.walk(path)
-		if max_dirs:
-			generator = itertools.islice(generator,max_dirs)
-		for (dirpath, dirnames, filenames) in generator:
+	def iter(path, start=None, stop=None, limit_to=None):
+		"""
+		iterate under a directory, yielding a succession of relative paths.
+		start, stop and limit_to are as for DirectoryTreeIterator, with
+		positions being in the order in which files are yielded.
+		"""
+		if limit_to:
+			start = limit_to
+			stop = limit_to
+		if type(start) == str:
+			start = start.split('/')
+		if type(stop) == str:
+			stop = stop.split('/')
+		startkey = start and _walk_key(path, start)
+		stopkey = stop and _walk_key(path, stop)
+		dirs = 0
+		for (dirpath, dirnames, filenames) in os.walk(path):
 			reldir = os.path.relpath(dirpath, path)
-			if not include_dir(reldir):
-				continue
-			filenames.sort()
-			for filename in filenames:
-				filepath = os.path.normpath(os.path.join(reldir, filename))
-				yield filepath
+			dirkey = reldir != '.' and [(1, s) for s in reldir.split(os.sep)] or []
+			# prune the subdirectories to be excluded before they are descended into
+			kept = []
+			for dirname in sorted(dirnames):
+				key = dirkey + [(1, dirname)]
+				if startkey and key < startkey[:len(key)]:
+					continue
+				if stopkey and key[:len(stopkey)] > stopkey[:len(key)]:
+					continue
+				if not include_dir(os.path.normpath(os.path.join(reldir, dirname))):
+					continue
+				kept.append(dirname)
+			dirnames[:] = kept
+			yielded = False
+			for filename in sorted(filenames):
+				key = dirkey + [(0, filename)]
+				if startkey and key < startkey:
+					continue
+				if stopkey and key[:len(stopkey)] > stopkey:
+					continue
+				if not yielded:
+					if max_dirs and dirs >= max_dirs:
+						return
+					dirs += 1
+					yielded = True
+				yield os.path.normpath(os.path.join(reldir, filename))
 	return iter
@@ -0,0 +1,88 @@
+import os
+import platform
+import resource
+import ctypes
+import ctypes.util
+
+# ioprio_set() has no wrapper in the C library, so is invoked by its system
+# call number, which depends on the architecture
+_IOPRIO_SET = {
+	'x86_64': 251,
+	'i386': 289,
+	'i686': 289,
+	'aarch64': 30,
+	'armv7l': 314,
+	'ppc64le': 273,
+	's390x': 282,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = { 'realtime': 1, 'best-effort': 2, 'idle': 3 }
+
+def _load_syscall():
+	try:
+		return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).syscall
+	except (OSError, AttributeError):
+		return None
+
+_syscall = _load_syscall()
+
+def ioprio_set(ioclass, level=0, pid=0):
+	"""
+	Set the I/O scheduling class ('realtime', 'best-effort' or 'idle') and
+	level (0-7, lower being higher priority) of the process with the pid
+	given, or of the calling process. This is only possible on Linux;
+	elsewhere, it does nothing.
+	"""
+	nr = _IOPRIO_SET.get(platform.machine())
+	if _syscall is None or nr is None:
+		return
+	value = (IOPRIO_CLASSES[ioclass] << _IOPRIO_CLASS_SHIFT) | level
+	if _syscall(nr, _IOPRIO_WHO_PROCESS, pid, value) != 0:
+		errno = ctypes.get_errno()
+		raise OSError(errno, "ioprio_set: %s"%os.strerror(errno))
+
+class ResourceLimits:
+	"""
+	Scheduling priorities and resource limits for processing, so that batch
+	processing can proceed as fast as the host allows without degrading
+	other services sharing it. These are applied to child processes before
+	they start processing, and are inherited by any processes they start in
+	turn. They are applied to external processes as soon as they have
+	started, as it is not safe to do so between forking and executing them
+	in a process which may have other threads; anything such a process does
+	in that first instant is not limited.
+	"""
+	def __init__(self, nice=None, ioclass=None, iolevel=0, cpus=None, memory=None, cpu_time=None):
+		"""
+		The arguments are all optional, and are:
+		- nice: the niceness to run at, from -20 to 19 (higher being lower priority); raising priority requires privileges
+		- ioclass, iolevel: the I/O scheduling class ('realtime', 'best-effort' or 'idle') and level within it (0-7); 'idle' processes only get disk time when no other process needs it
+		- cpus: the set of CPU numbers the processes may run on
+		- memory: the maximum size of a process's address space, in bytes (RLIMIT_AS)
+		- cpu_time: the maximum CPU time a process may use, in seconds (RLIMIT_CPU), after which it is killed
+		"""
+		if ioclass is not None and ioclass not in IOPRIO_CLASSES:
+			raise ValueError("ioclass must be one of: %s"%", ".join(IOPRIO_CLASSES))
+		self.nice = nice
+		self.ioclass = ioclass
+		self.iolevel = iolevel
+		self.cpus = cpus
+		self.memory = memory
+		self.cpu_time = cpu_time
+
+	def apply(self, pid=0):
+		"Apply the limits to the process with the pid given, or to the calling process"
+		if self.nice is not None:
+			os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+		if self.ioclass is not None:
+			ioprio_set(self.ioclass, self.iolevel, pid)
+		if self.cpus is not None:
+			os.sched_setaffinity(pid, self.cpus)
+		for (limit, value) in [(resource.RLIMIT_AS, self.memory), (resource.RLIMIT_CPU, self.cpu_time)]:
+			if value is None:
+				continue
+			if pid:
+				resource.prlimit(pid, limit, (value, value))
+			else:
+				resource.setrlimit(limit, (value, value))
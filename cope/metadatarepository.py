@@ -1,5 +1,9 @@
 import os.path
+import json
 from .provenancetracker import ProvenanceTracker
+from .provenancelog import LogProvenanceTracker
+from .provenancecompact import CompactProvenanceTracker
+from .dirlisting import DirectoryListingCache
 
 class MetadataRepository:
 	"""
@@ -9,10 +13,22 @@ class MetadataRepository:
 	# this class is the source of truth for the metadata directory path and
 	# the files contained therein.
 
-	def __init__(self, destpath, metadatadirname=".copemetadata"):
+	# the provenance tracker implementations available, and the files they keep
+	# their records in
+	PROVENANCE_BACKENDS = {
+		'sqlite': (ProvenanceTracker, "provenance.sqlite"),
+		'log': (LogProvenanceTracker, "provenance.log"),
+		# this shares its file with 'sqlite', so that records made with that are converted when first opened with this
+		'compact': (CompactProvenanceTracker, "provenance.sqlite"),
+	}
+
+	def __init__(self, destpath, metadatadirname=".copemetadata", provenance='sqlite'):
+		self.destpath = destpath
 		self.dirpath = os.path.join(destpath, metadatadirname)
-		dbpath = os.path.join(self.dirpath, "provenance.sqlite")
-		self.provenancetracker = ProvenanceTracker(dbpath)
+		if provenance not in MetadataRepository.PROVENANCE_BACKENDS:
+			raise ValueError("unknown provenance backend: %s"%provenance)
+		(trackerclass, filename) = MetadataRepository.PROVENANCE_BACKENDS[provenance]
+		self.provenancetracker = trackerclass(os.path.join(self.dirpath, filename))
 
 	# --- provenance tracking
 
@@ -20,10 +36,99 @@ class MetadataRepository:
 		"Returns the path of the product file produced for an input, or None if none exists"
 		return self.provenancetracker.check(inpath, mtime, opname)
 
-	def record_product(self, inpath, inmtime, outpath, outmtime, opname=None, timestamp=None):
-		return self.provenancetracker.record(inpath, inmtime, outpath, outmtime, opname, timestamp)
+	def lookup_product(self, inpath, mtime, opname=None):
+		"Returns the provenance record of the product file produced for an input, or None if none exists"
+		return self.provenancetracker.lookup(inpath, mtime, opname)
+
+	def lookup_output(self, outpath):
+		"Returns the provenance record of the product file with the path given, or None if there is none"
+		return self.provenancetracker.lookup_output(outpath)
+
+	def lookup_moved_product(self, identity, mtime):
+		"Returns the provenance records of the product files produced for an input with an identity (a (device, inode, size) tuple), under any path"
+		return self.provenancetracker.lookup_identity(identity, mtime)
+
+	def record_product(self, inpath, inmtime, outpath, outmtime, opname=None, timestamp=None, outsize=None, commit=True, identity=None):
+		return self.provenancetracker.record(inpath, inmtime, outpath, outmtime, opname, timestamp, outsize, commit, identity)
+
+	def record_product_identity(self, outpath, identity, commit=True):
+		"Records the identity (a (device, inode, size) tuple) of the input file of a product recorded without one"
+		self.provenancetracker.record_identity(outpath, identity, commit)
+
+	def delete_products(self, outpaths):
+		"Deletes the provenance records of the product files with the paths given"
+		self.provenancetracker.delete(outpaths)
+
+	def commit(self):
+		"Commit any products recorded with commit=False"
+		self.provenancetracker.commit()
+
+	def provenance_records(self, inprefix=None, outpath=None, since=None, until=None, order=None):
+		"Yields the provenance records matching the criteria given; see ProvenanceTracker.records"
+		return self.provenancetracker.records(inprefix, outpath, since, until, order=order)
+
+	def product_count(self):
+		"Returns the number of products recorded"
+		return self.provenancetracker.count()
+
+	def find_orphans(self, srcpath=None, outputs=True):
+		"""
+		Yields the provenance records whose output no longer exists (if outputs
+		is true) or whose input no longer exists under srcpath (if given).
+		Existence is checked against directory listings, rather than by
+		stat-ing each path; the records are examined in order of the paths
+		being checked, so that each directory need only be listed once.
+		"""
+		# the outputs of the orphans already found, which are not to be yielded twice
+		found = set()
+		if outputs:
+			products = DirectoryListingCache(self.destpath)
+			for record in self.provenancetracker.records(order='outpath'):
+				if not products.exists(record.outpath):
+					found.add(record.outpath)
+					yield record
+		if srcpath:
+			sources = DirectoryListingCache(srcpath)
+			for record in self.provenancetracker.records(order='inpath'):
+				if record.outpath not in found and not sources.exists(record.inpath):
+					yield record
+
+	def purge_orphans(self, srcpath=None, outputs=True, batch_size=500):
+		"Deletes the records find_orphans yields, returning how many were deleted"
+		count = 0
+		batch = []
+		for record in self.find_orphans(srcpath, outputs):
+			batch.append(record.outpath)
+			if len(batch) >= batch_size:
+				self.provenancetracker.delete(batch)
+				count += len(batch)
+				batch = []
+		self.provenancetracker.delete(batch)
+		return count + len(batch)
+
+	def compact(self):
+		"Reclaims the space left by deleted records and refreshes the query planner's statistics"
+		self.provenancetracker.vacuum()
+		self.provenancetracker.analyze()
 
 	# --- last-processed handling
 
 	def get_last_processed(self):
 		return self.provenancetracker.most_recently_processed()
+
+	# --- run statistics
+
+	def save_run_stats(self, stats):
+		"Saves a dictionary of statistics about a run, for the next run to consult"
+		path = os.path.join(self.dirpath, "runstats.json")
+		with open(path + ".tmp", 'w') as f:
+			json.dump(stats, f)
+		os.replace(path + ".tmp", path)
+
+	def get_last_run_stats(self):
+		"Returns the statistics saved by the last run, or None"
+		try:
+			with open(os.path.join(self.dirpath, "runstats.json")) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
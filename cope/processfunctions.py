@@ -1,6 +1,15 @@
 import subprocess
 import shutil
 import os
+import signal
+import gzip
+import bz2
+import lzma
+import mmap
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from . import watchdog
 
 
 # constants for use in process argument replacement
@@ -10,39 +19,289 @@ OUTFILE = 2
 def _sub_arglist(src, dest, args):
 	return [ a == INFILE and src or a == OUTFILE and dest or a for a in args ]
 
+def _run_in_group(args, timeout=None, stdout=None, stderr=None, limits=None):
+	"""
+	Run a process in a process group of its own, raising a 
+	subprocess.CalledProcessError if it returns a nonzero status code. If it 
+	runs for longer than timeout seconds, the whole group (including any 
+	processes it started) is killed, and subprocess.TimeoutExpired raised; 
+	the group is likewise killed if waiting for it is interrupted by any 
+	other exception (such as KeyboardInterrupt). If limits (a 
+	ResourceLimits) is given, they are applied to the process as soon as it 
+	has started.
+	"""
+	with subprocess.Popen(args, stdout=stdout, stderr=stderr, start_new_session=True) as p:
+		watchdog.process_groups.add(p.pid)
+		try:
+			if limits:
+				_limit(p, limits)
+			(out, err) = p.communicate(timeout=timeout)
+		except BaseException:
+			try:
+				os.killpg(p.pid, signal.SIGKILL)
+			except ProcessLookupError:
+				pass
+			p.communicate()
+			raise
+		finally:
+			watchdog.process_groups.discard(p.pid)
+	if p.returncode != 0:
+		raise subprocess.CalledProcessError(p.returncode, args, stderr=err)
+
+def _limit(p, limits):
+	"Apply limits to a process which has been started, unless it has already exited"
+	try:
+		limits.apply(p.pid)
+	except ProcessLookupError:
+		pass
+
+class PipelineError(subprocess.CalledProcessError):
+	"""
+	Raised when a stage of a pipeline returns a nonzero status code. stage 
+	is the index of the failing stage (the last one to fail, if several 
+	did, disregarding those killed by SIGPIPE), and returncodes holds the 
+	status codes of all stages.
+	"""
+	def __init__(self, stage, returncodes, cmd):
+		subprocess.CalledProcessError.__init__(self, returncodes[stage], cmd)
+		self.stage = stage
+		self.returncodes = returncodes
+
+	def __str__(self):
+		return "Pipeline stage %d (%s) returned non-zero exit status %d."%(self.stage, self.cmd, self.returncode)
+
+def _map(f, access=mmap.ACCESS_READ):
+	"Memory-map an open file, returning None if it is empty (as empty files cannot be mapped)"
+	if os.fstat(f.fileno()).st_size == 0:
+		return None
+	return mmap.mmap(f.fileno(), 0, access=access)
+
+@contextmanager
+def _mapped_view(f, access=mmap.ACCESS_READ):
+	"""
+	Memory-map an open file, yielding a memoryview of it, and release both
+	afterwards, flushing any changes if the mapping is writable. If the
+	function using the view kept references to it, releasing it raises
+	BufferError; if that function raised an exception itself, that is
+	raised instead.
+	"""
+	mapped = _map(f, access)
+	view = memoryview(mapped if mapped is not None else access == mmap.ACCESS_WRITE and bytearray() or b'')
+	def release():
+		view.release()
+		if mapped is not None:
+			mapped.close()
+	try:
+		yield view
+		if mapped is not None and access == mmap.ACCESS_WRITE:
+			mapped.flush()
+	except BaseException:
+		try:
+			release()
+		except BufferError:
+			pass
+		raise
+	release()
+
+# for each compression format: a function opening a compressing writer on a
+# file object, and one compressing a block into a complete, independent stream
+_COMPRESSORS = {
+	'gzip': (
+		lambda fo, level: gzip.GzipFile(fileobj=fo, mode='wb', compresslevel=level, mtime=0),
+		lambda block, level: gzip.compress(block, level, mtime=0),
+		6
+	),
+	'bz2': (
+		lambda fo, level: bz2.BZ2File(fo, 'wb', compresslevel=level),
+		lambda block, level: bz2.compress(block, level),
+		9
+	),
+	'lzma': (
+		lambda fo, level: lzma.LZMAFile(fo, 'wb', preset=level),
+		lambda block, level: lzma.compress(block, preset=level),
+		6
+	),
+}
+
 class Process:
 	"""
 	A namespace containing some useful processing functions or functions that generate them
 	"""
 	@staticmethod
-	def run(*args):
+	def run(*args, timeout=None, limits=None):
 		"""
 		Return a processing function that runs an external process with the 
 		array of arguments specified, substituting the input and output file
 		paths for the INFILE and OUTFILE placeholders. This process is assumed
 		to create the output file as a side-effect. If it returns a nonzero
-		status code, a subprocess exception is raised.
+		status code, a subprocess exception is raised. If timeout is given and 
+		the process runs for longer than that many seconds, it is killed, 
+		along with any processes it started, and subprocess.TimeoutExpired is 
+		raised. If limits (a ResourceLimits) is given, the process is run 
+		with those priorities and resource limits.
 		"""
 		def proc(src, dest):
 			args2 = _sub_arglist(src, dest, args)
-			subprocess.run(args2, check=True)
+			_run_in_group(args2, timeout, limits=limits)
 		return proc
 
 	@staticmethod
-	def captureOutputOf(*args):
+	def captureOutputOf(*args, timeout=None, limits=None):
 		"""
 		Return a processing function that runs an external process with the 
 		array of arguments specified, substituting the input file paths for 
 		the INFILE placeholder, and capture its standard output into the 
 		output file.  If it returns a nonzero status code, a subprocess 
-		exception is raised.
+		exception is raised. timeout and limits are as for run.
 		"""
 		def proc(src, dest):
 			args2 = _sub_arglist(src, None, args)
 			with open(dest, 'wb') as fo:
-				res = subprocess.run(args2, capture_output=True, check=True)
-				fo.write(res.stdout)
+				_run_in_group(args2, timeout, stdout=fo, stderr=subprocess.PIPE, limits=limits)
+
+		return proc
+
+	@staticmethod
+	def fromStream(fn):
+		"""
+		Return a processing function which calls fn with a readable binary 
+		file object of the input file, rather than its path, and the output 
+		path. Where the input comes from an archive, this allows it to be 
+		read directly from the archive, rather than being extracted first.
+		"""
+		def proc(src, dest):
+			with open(src, 'rb') as fi:
+				fn(fi, dest)
+		proc.streaming = fn
+		return proc
+
+	@staticmethod
+	def pipeline(*cmds, limits=None):
+		"""
+		Return a processing function that runs a pipeline of external 
+		processes, each specified as a list of arguments, with the standard 
+		output of each connected to the standard input of the next, and that 
+		of the last written into the output file. The input file is supplied 
+		on the standard input of the first process, unless the INFILE 
+		placeholder appears in its arguments; if the OUTFILE placeholder 
+		appears in the arguments of the last process, it is presumed to 
+		create the output file itself. If any process returns a nonzero 
+		status code, a PipelineError identifying it is raised; a process 
+		other than the last which is killed by SIGPIPE has merely had the 
+		rest of its output declined by the next, so is not considered to 
+		have failed. limits are as for run, and apply to each process.
+		"""
+		def proc(src, dest):
+			stages = [_sub_arglist(src, dest, cmd) for cmd in cmds]
+			fi = INFILE not in cmds[0] and open(src, 'rb') or None
+			fo = OUTFILE not in cmds[-1] and open(dest, 'wb') or None
+			procs = []
+			try:
+				stdin = fi or subprocess.DEVNULL
+				for (i, args) in enumerate(stages):
+					stdout = i < len(stages)-1 and subprocess.PIPE or fo
+					procs.append(subprocess.Popen(args, stdin=stdin, stdout=stdout))
+					if limits:
+						_limit(procs[-1], limits)
+					if i > 0:
+						# leave the next stage as the only reader, so this one receives SIGPIPE if it exits early
+						stdin.close()
+					stdin = procs[-1].stdout
+			except:
+				for p in procs:
+					p.kill()
+					p.wait()
+				raise
+			finally:
+				fi and fi.close()
+				fo and fo.close()
+			returncodes = [p.wait() for p in procs]
+			failed = [i for (i, r) in enumerate(returncodes) if r != 0 and not (r == -signal.SIGPIPE and i < len(returncodes)-1)]
+			if failed:
+				raise PipelineError(failed[-1], returncodes, stages[failed[-1]])
+		return proc
+
+	@staticmethod
+	def transform(fn, buffersize=1<<20):
+		"""
+		Return a processing function which calls fn with a read-only 
+		memoryview of the input file and a buffered binary writer for the 
+		output file. The input is memory-mapped rather than read, so it is 
+		paged in as fn reads it, and slicing it makes no copies. fn must not 
+		keep any references to the memoryview (or to slices of it) after it 
+		returns.
+		"""
+		def proc(src, dest):
+			with open(src, 'rb') as fi, open(dest, 'wb', buffering=buffersize) as fo:
+				with _mapped_view(fi) as view:
+					fn(view, fo)
+		return proc
+
+	@staticmethod
+	def transformChunks(fn, chunksize=1<<20):
+		"""
+		Return a processing function which calls fn with successive read-only 
+		memoryviews of the input file, chunksize bytes at a time, writing 
+		whatever bytes-like object it returns for each (if not None) to the 
+		output file.
+		"""
+		def transform(view, fo):
+			for offset in range(0, len(view), chunksize):
+				with view[offset:offset+chunksize] as chunk:
+					result = fn(chunk)
+					if result is not None:
+						fo.write(result)
+		return Process.transform(transform)
+
+	@staticmethod
+	def patch(fn):
+		"""
+		Return a processing function which copies the input file to the 
+		output file, and then calls fn with a writable memoryview of the 
+		output, to modify in place. This suits changes that leave most of a 
+		file as it is, such as rewriting fixed-size headers. As with 
+		transform, fn must not keep references to the memoryview.
+		"""
+		def proc(src, dest):
+			shutil.copyfile(src, dest)
+			with open(dest, 'r+b') as f:
+				with _mapped_view(f, mmap.ACCESS_WRITE) as view:
+					fn(view)
+		return proc
+
+	@staticmethod
+	def compress(format='gzip', level=None, blocksize=1<<20, threads=1):
+		"""
+		Return a processing function that compresses the input file into the 
+		output file, in the format given ('gzip', 'bz2' or 'lzma'), reading 
+		it in blocks of blocksize bytes so that memory use is bounded. If 
+		threads is more than 1, blocks are compressed independently on that 
+		many threads (in the manner of pigz) and their compressed streams are 
+		concatenated, which the standard decompressors of all three formats 
+		read as a single file.
+		"""
+		if format not in _COMPRESSORS:
+			raise ValueError("unknown compression format: %s"%format)
+		(writer, compressor, default_level) = _COMPRESSORS[format]
+		level = level is None and default_level or level
 
+		def proc(src, dest):
+			with open(src, 'rb') as fi, open(dest, 'wb') as fo:
+				if threads <= 1:
+					with writer(fo, level) as fz:
+						shutil.copyfileobj(fi, fz, blocksize)
+					return
+				with ThreadPoolExecutor(max_workers=threads) as pool:
+					# keep a bounded number of blocks in flight, writing them in order
+					pending = deque()
+					for block in iter(lambda: fi.read(blocksize), b''):
+						if len(pending) >= threads*2:
+							fo.write(pending.popleft().result())
+						pending.append(pool.submit(compressor, block, level))
+					while pending:
+						fo.write(pending.popleft().result())
+					if fo.tell() == 0:
+						fo.write(compressor(b'', level))
 		return proc
 
 	copy = shutil.copy
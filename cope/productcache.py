@@ -0,0 +1,136 @@
+import os
+import os.path
+import time
+import shutil
+import sqlite3
+import fcntl
+import hashlib
+
+# the ioctl cloning a file's extents into another file on filesystems which
+# support it (such as btrfs and XFS)
+FICLONE = 0x40049409
+
+def reflink(src, dest):
+	"Make dest a copy-on-write clone of src, raising OSError if the filesystem does not support this"
+	with open(src, 'rb') as fi, open(dest, 'wb') as fo:
+		try:
+			fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+		except OSError:
+			fo.close()
+			os.unlink(dest)
+			raise
+
+def materialise(src, dest, hardlink=True):
+	"""
+	Make dest a copy of src as cheaply as possible: by reflinking it if the
+	filesystem allows, otherwise by hard-linking it (if hardlink is true),
+	otherwise by copying it.
+	"""
+	# any existing file is replaced rather than overwritten, as it may itself
+	# be a hard link to a cached output
+	if os.path.lexists(dest):
+		os.unlink(dest)
+	try:
+		reflink(src, dest)
+		return
+	except OSError:
+		pass
+	if hardlink:
+		try:
+			os.link(src, dest)
+			return
+		except OSError:
+			pass
+	shutil.copyfile(src, dest)
+
+class ProductCache:
+	"""
+	A cache of the outputs of an operation, keyed by the content of their
+	inputs, so that an output need only be generated once for any number of
+	byte-identical inputs, even where these are processed by different
+	FileProcessors. Outputs are materialised from the cache by reflinking,
+	hard-linking or copying them.
+
+	Several caches for different operations may share a directory, and it
+	may be used by several processes at once. Once the outputs it holds
+	exceed max_size bytes, the least recently used are evicted.
+	"""
+	def __init__(self, path, operation, max_size=1<<30, hardlink=True):
+		"""
+		The arguments are:
+		- path: the directory the cache is kept in
+		- operation: a string identifying the operation whose outputs are cached (and its version); outputs are only shared between caches with the same operation
+		- max_size: the total size of the outputs kept, in bytes
+		- hardlink: whether outputs may be materialised by hard-linking them where they cannot be reflinked; this is cheaper than copying, though an output modified in place would then modify the cached copy as well
+		"""
+		self.path = path
+		self.operation = operation
+		self.max_size = max_size
+		self.hardlink = hardlink
+		self.objectspath = os.path.join(path, "objects")
+		os.makedirs(self.objectspath, exist_ok=True)
+		self.dbc = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=60, isolation_level=None)
+		self.dbc.execute("create table if not exists entry (key VARCHAR PRIMARY KEY, size INT, atime INT)")
+		self.dbc.execute("create index if not exists entry_atime on entry (atime)")
+
+	def _key(self, digest):
+		return hashlib.sha256(("%s\0%s"%(self.operation, digest)).encode('utf-8')).hexdigest()
+
+	def _object_path(self, key):
+		return os.path.join(self.objectspath, key[:2], key)
+
+	def fetch(self, digest, dest):
+		"Materialise the output cached for an input with the content digest given at dest, returning whether there was one"
+		key = self._key(digest)
+		if not self.dbc.execute("select 1 from entry where key=?", (key,)).fetchone():
+			return False
+		try:
+			materialise(self._object_path(key), dest, self.hardlink)
+		except FileNotFoundError:
+			# evicted by another process in the meantime
+			self.dbc.execute("delete from entry where key=?", (key,))
+			return False
+		self.dbc.execute("update entry set atime=? where key=?", (int(time.time()*1000000), key))
+		return True
+
+	def store(self, digest, src):
+		"Add the file at src to the cache, as the output for an input with the content digest given"
+		key = self._key(digest)
+		opath = self._object_path(key)
+		os.makedirs(os.path.dirname(opath), exist_ok=True)
+		# the object is only put in place complete, so other processes never see part of it
+		tpath = "%s.%d.tmp"%(opath, os.getpid())
+		materialise(src, tpath, self.hardlink)
+		os.replace(tpath, opath)
+		size = os.stat(opath).st_size
+		self.dbc.execute("insert or replace into entry (key, size, atime) values (?, ?, ?)", (key, size, int(time.time()*1000000)))
+		self.evict()
+
+	def size(self):
+		"Return the total size of the outputs in the cache"
+		return self.dbc.execute("select coalesce(sum(size), 0) from entry").fetchone()[0]
+
+	def evict(self):
+		"Evict the least recently used outputs until those remaining fit within max_size"
+		cur = self.dbc.cursor()
+		# taking the write lock first keeps concurrent evictions from overlapping
+		cur.execute("begin immediate")
+		try:
+			excess = self.size() - self.max_size
+			evicted = []
+			if excess > 0:
+				for (key, size) in cur.execute("select key, size from entry order by atime, rowid"):
+					evicted.append(key)
+					excess -= size
+					if excess <= 0:
+						break
+				cur.executemany("delete from entry where key=?", ((k,) for k in evicted))
+			cur.execute("commit")
+		except:
+			cur.execute("rollback")
+			raise
+		for key in evicted:
+			try:
+				os.unlink(self._object_path(key))
+			except FileNotFoundError:
+				pass
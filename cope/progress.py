@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+from collections import namedtuple, deque, Counter
+
+ProgressSummary = namedtuple('ProgressSummary', ['files', 'bytes', 'files_per_second', 'bytes_per_second', 'eta', 'counts'])
+ProgressSummary.__doc__ = """
+A summary of a run's progress so far:
+- files: the number of files handled, one way or another
+- bytes: the total size of the input files processed
+- files_per_second, bytes_per_second: the recent rates of handling files and processing bytes
+- eta: the estimated number of seconds until all the files expected have been handled, or None if this is not known
+- counts: a Counter of the ProgressTypes of the files handled
+"""
+
+class ProgressReporter:
+	"""
+	An onprogress function for FileProcessor which takes progress reporting
+	off the processing loop. Events are put on a bounded queue, which a
+	background thread drains in batches, calling an onprogress function of
+	its own for each event and an onsummary function with a
+	ProgressSummary periodically. If either function raises an exception,
+	the events continue to be handled, and the first such exception in each
+	run is kept in the reporter's error attribute; a failure to report
+	progress does not stop the run being reported on.
+	"""
+	def __init__(self, onprogress=None, onsummary=None, interval=5.0, expected=None, window=30.0, queue_size=10000, batch_size=1000):
+		"""
+		The arguments are:
+		- onprogress: an optional function called, on the background thread, with the arguments of each event (a ProgressType, a source path, a destination path or error, and the size of the source file)
+		- onsummary: an optional function called, on the background thread, with a ProgressSummary every interval seconds and once the run is complete
+		- expected: the number of files the run is expected to handle (i.e., from counting them beforehand), from which the time remaining is estimated. If omitted, the number handled by the previous run is used, where known.
+		- window: the number of seconds over which rates are calculated
+		- queue_size: the number of events which may be waiting at once; beyond this, reporting an event waits for the background thread
+		- batch_size: the most events handled in one batch
+		"""
+		self.onprogress = onprogress
+		self.onsummary = onsummary
+		self.interval = interval
+		self.precount = expected
+		self.window = window
+		self.batch_size = batch_size
+		self.queue = queue.Queue(queue_size)
+		self.lock = threading.Lock()
+		self.begin()
+		self.thread = threading.Thread(target=self._consume, daemon=True)
+		self.thread.start()
+
+	def begin(self, expected=None):
+		"Called by FileProcessor at the start of a run, with the number of files the previous run handled, if known"
+		# the first exception raised by onprogress or onsummary in this run
+		self.error = None
+		with self.lock:
+			self.expected = self.precount or expected
+			self.files = 0
+			self.bytes = 0
+			self.counts = Counter()
+			# (time, files, bytes) samples over the rate window
+			self.samples = deque([(time.monotonic(), 0, 0)])
+		self.last_summary = time.monotonic()
+
+	def __call__(self, progresstype, src, dest, size=None):
+		self.queue.put((progresstype, src, dest, size))
+
+	def _consume(self):
+		while True:
+			batch = []
+			try:
+				batch.append(self.queue.get(timeout=self.interval))
+				while len(batch) < self.batch_size:
+					batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+			flushes = []
+			with self.lock:
+				for event in batch:
+					if isinstance(event, threading.Event):
+						flushes.append(event)
+						continue
+					(progresstype, src, dest, size) = event
+					self.files += 1
+					self.counts[progresstype] += 1
+					if size and progresstype.name == 'PROCESSED':
+						self.bytes += size
+				now = time.monotonic()
+				self.samples.append((now, self.files, self.bytes))
+				while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+					self.samples.popleft()
+			if self.onprogress:
+				for event in batch:
+					if not isinstance(event, threading.Event):
+						self._call(self.onprogress, *event)
+			if self.onsummary and (flushes or now - self.last_summary >= self.interval):
+				self.last_summary = now
+				self._call(self.onsummary, self.summary())
+			for flush in flushes:
+				flush.set()
+
+	def _call(self, fn, *args):
+		# an exception must not stop the thread, or flush() and reporting would wait for it forever
+		try:
+			fn(*args)
+		except Exception as e:
+			if self.error is None:
+				self.error = e
+
+	def summary(self):
+		"Return a ProgressSummary of the progress so far"
+		with self.lock:
+			(t0, files0, bytes0) = self.samples[0]
+			(t1, files1, bytes1) = self.samples[-1]
+			elapsed = t1 - t0
+			files_per_second = elapsed > 0 and (files1 - files0)/elapsed or 0.0
+			bytes_per_second = elapsed > 0 and (bytes1 - bytes0)/elapsed or 0.0
+			eta = None
+			if self.expected is not None and files_per_second > 0:
+				eta = max(self.expected - self.files, 0)/files_per_second
+			return ProgressSummary(self.files, self.bytes, files_per_second, bytes_per_second, eta, Counter(self.counts))
+
+	def flush(self):
+		"Wait until all events reported so far have been handled; FileProcessor calls this at the end of each run"
+		done = threading.Event()
+		self.queue.put(done)
+		done.wait()
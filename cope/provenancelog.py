@@ -0,0 +1,204 @@
+import os
+import os.path
+import json
+import time
+from .provenancetracker import Record
+
+class LogProvenanceTracker:
+	"""
+	A provenance tracker keeping its records in memory, and persisting them
+	as an append-only log of changes, which is periodically compacted into a
+	snapshot. On opening, the snapshot is loaded and the log replayed over it.
+
+	This needs no locking and only ever appends to its files, which makes it
+	suitable for filesystems on which SQLite's locking is slow or unreliable
+	(such as NFS or FUSE mounts). It supports the same operations as
+	ProvenanceTracker, and only one process may use it at a time.
+	"""
+	def __init__(self, logpath, snapshotpath=None, compact_every=10000):
+		"""
+		The arguments are:
+		- logpath: the path of the log
+		- snapshotpath: the path of the snapshot; this defaults to that of the log, with the extension .snapshot
+		- compact_every: the number of changes the log may hold before it is compacted; to keep compaction cheap relative to appending, this is raised to the number of records held if that is greater
+		"""
+		self.logpath = logpath
+		self.snapshotpath = snapshotpath or os.path.splitext(logpath)[0] + ".snapshot"
+		self.compact_every = compact_every
+		# records, by output path, in the order in which they were made
+		self.records_by_outpath = {}
+		# the output paths recorded for each input path
+		self.outpaths_by_inpath = {}
+		# the output paths recorded for each input file identity
+		self.outpaths_by_identity = {}
+		self.logged = 0
+		os.makedirs(os.path.dirname(self.logpath), exist_ok=True)
+		self._load()
+		self.log = open(self.logpath, 'a')
+
+	def _load(self):
+		for path in [self.snapshotpath, self.logpath]:
+			if not os.path.isfile(path):
+				continue
+			# the length of the file up to the end of the last complete entry
+			complete = 0
+			with open(path, 'rb') as f:
+				for line in f:
+					try:
+						entry = json.loads(line.decode())
+					except ValueError:
+						entry = None
+					if entry is None or not line.endswith(b"\n"):
+						# only the last line may be incomplete, if a write was interrupted
+						break
+					complete += len(line)
+					if "r" in entry:
+						self._put(Record(*entry["r"]))
+					elif "d" in entry:
+						self._remove(entry["d"])
+					elif "i" in entry:
+						self._set_identity(entry["i"][0], entry["i"][1:])
+					if path == self.logpath:
+						self.logged += 1
+			if path == self.logpath and complete < os.path.getsize(path):
+				# so that subsequent entries are not appended to the incomplete one
+				os.truncate(path, complete)
+
+	def _put(self, record):
+		self._remove(record.outpath)
+		self.records_by_outpath[record.outpath] = record
+		self.outpaths_by_inpath.setdefault(record.inpath, set()).add(record.outpath)
+		if record.inino is not None:
+			self.outpaths_by_identity.setdefault((record.indev, record.inino), set()).add(record.outpath)
+
+	def _remove(self, outpath):
+		record = self.records_by_outpath.pop(outpath, None)
+		if record:
+			outpaths = self.outpaths_by_inpath[record.inpath]
+			outpaths.discard(outpath)
+			if not outpaths:
+				del self.outpaths_by_inpath[record.inpath]
+			if record.inino is not None:
+				outpaths = self.outpaths_by_identity[(record.indev, record.inino)]
+				outpaths.discard(outpath)
+				if not outpaths:
+					del self.outpaths_by_identity[(record.indev, record.inino)]
+
+	def _set_identity(self, outpath, identity):
+		record = self.records_by_outpath.get(outpath)
+		if record:
+			if record.inino is not None:
+				self.outpaths_by_identity[(record.indev, record.inino)].discard(outpath)
+			(dev, ino, size) = identity
+			# replacing the record in place keeps it in the order in which it was made
+			self.records_by_outpath[outpath] = record._replace(indev=dev, inino=ino, insize=size)
+			self.outpaths_by_identity.setdefault((dev, ino), set()).add(outpath)
+
+	def _append(self, entry):
+		self.log.write(json.dumps(entry) + "\n")
+		self.logged += 1
+
+	def check(self, inpath, mtime, opname=None):
+		"Checks if if an output file has been created for an input file with a name and creation time, returning the outpath or None"
+		r = self.lookup(inpath, mtime, opname)
+		return r and r.outpath
+
+	def lookup(self, inpath, mtime, opname=None):
+		"Returns the Record of an output file created for an input file with a name and creation time, or None"
+		for outpath in self.outpaths_by_inpath.get(inpath, ()):
+			record = self.records_by_outpath[outpath]
+			if record.inmtime == mtime and (not opname or record.opname == opname):
+				return record
+		return None
+
+	def lookup_output(self, outpath):
+		"Returns the Record of the output file with the path given, or None"
+		return self.records_by_outpath.get(outpath)
+
+	def lookup_identity(self, identity, mtime):
+		"Returns the Records of the output files created for an input file with an identity (a (device, inode, size) tuple) and creation time"
+		(dev, ino, size) = identity
+		records = (self.records_by_outpath[outpath] for outpath in self.outpaths_by_identity.get((dev, ino), ()))
+		return [r for r in records if r.insize == size and r.inmtime == mtime]
+
+	def record(self, inpath, inmtime, outpath, outmtime, opname=None, timestamp=None, outsize=None, commit=True, identity=None):
+		"Record the processing of a file; see ProvenanceTracker.record"
+		record = Record(inpath, inmtime, outpath, outmtime, opname, int(timestamp or time.time()), outsize, *(identity or (None, None, None)))
+		self._put(record)
+		self._append({"r": list(record)})
+		if commit:
+			self.commit()
+
+	def record_identity(self, outpath, identity, commit=True):
+		"Record the identity of the input file of an output recorded without one; see ProvenanceTracker.record_identity"
+		if outpath in self.records_by_outpath:
+			self._set_identity(outpath, identity)
+			self._append({"i": [outpath] + list(identity)})
+		if commit:
+			self.commit()
+
+	def commit(self):
+		"Make the records made so far durable, compacting the log if it has grown long enough"
+		self.log.flush()
+		os.fsync(self.log.fileno())
+		if self.logged >= max(self.compact_every, len(self.records_by_outpath)):
+			self.compact()
+
+	def most_recently_processed(self):
+		if not self.records_by_outpath:
+			return None
+		return next(reversed(self.records_by_outpath.values())).inpath
+
+	def count(self):
+		"Return the number of records"
+		return len(self.records_by_outpath)
+
+	def records(self, inprefix=None, outpath=None, since=None, until=None, batch_size=None, order=None):
+		"Yield the Records matching all of the criteria given; see ProvenanceTracker.records"
+		if outpath is not None:
+			candidates = outpath in self.records_by_outpath and [self.records_by_outpath[outpath]] or []
+		else:
+			# take a copy, so that records may be deleted whilst this is being iterated over
+			candidates = list(self.records_by_outpath.values())
+		if inprefix:
+			inprefix = inprefix.rstrip('/')
+			candidates = sorted((r for r in candidates if r.inpath == inprefix or r.inpath.startswith(inprefix+'/')), key=lambda r: r.inpath)
+		if order in ('inpath', 'outpath'):
+			candidates = sorted(candidates, key=lambda r: getattr(r, order))
+		for record in candidates:
+			if since is not None and record.timestamp < since:
+				continue
+			if until is not None and record.timestamp >= until:
+				continue
+			yield record
+
+	def delete(self, outpaths):
+		"Delete the records of the outputs with the paths given"
+		for outpath in outpaths:
+			if outpath in self.records_by_outpath:
+				self._remove(outpath)
+				self._append({"d": outpath})
+		self.commit()
+
+	def compact(self):
+		"Write all records to a new snapshot, and empty the log"
+		temppath = self.snapshotpath + ".tmp"
+		with open(temppath, 'w') as f:
+			for record in self.records_by_outpath.values():
+				f.write(json.dumps({"r": list(record)}) + "\n")
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(temppath, self.snapshotpath)
+		# replaying the log over the new snapshot changes nothing, so a crash before it is emptied is harmless
+		self.log.close()
+		self.log = open(self.logpath, 'w')
+		self.logged = 0
+
+	def vacuum(self):
+		"Compact the log"
+		self.log.flush()
+		self.compact()
+
+	def analyze(self):
+		"There are no statistics to update"
+		pass
@@ -2,6 +2,27 @@ import os
 import os.path
 import time
 import sqlite3
+from collections import namedtuple
+
+# the columns of the oprecord table; those after the first six were added
+# later, and are added to older databases when they are opened
+COLUMNS = [
+	("inpath", "VARCHAR"),
+	("inmtime", "INT"),
+	("outpath", "VARCHAR PRIMARY KEY"),
+	("outmtime", "INT"),
+	("opname", "VARCHAR"),
+	("timestamp", "INT"),
+	("outsize", "INT"),
+	# the identity of the input file (its device, inode and size), by which it
+	# may be recognised if it is moved
+	("indev", "INT"),
+	("inino", "INT"),
+	("insize", "INT"),
+]
+FIELDS = [c[0] for c in COLUMNS]
+
+Record = namedtuple('Record', FIELDS, defaults=[None]*(len(COLUMNS)-6))
 
 class ProvenanceTracker:
 	def __init__(self, dbpath):
@@ -13,28 +34,72 @@ class ProvenanceTracker:
 		os.makedirs(dir, exist_ok=True)
 		db_existed = os.path.isfile(self.dbpath)
 		dbc = sqlite3.connect(self.dbpath)
+		if dbc.execute("select 1 from sqlite_master where name='oprecord_compact'").fetchone():
+			dbc.close()
+			raise ValueError("%s holds compact provenance records, so must be opened with CompactProvenanceTracker"%self.dbpath)
 		if not db_existed:
 			cur = dbc.cursor()
-			cur.execute("create table oprecord (inpath VARCHAR, inmtime INT, outpath VARCHAR PRIMARY KEY, outmtime INT, opname VARCHAR, timestamp INT)")
-			dbc.commit()
+			cur.execute("create table oprecord (%s)"%", ".join("%s %s"%c for c in COLUMNS))
+		existing = [r[1] for r in dbc.execute("pragma table_info(oprecord)")]
+		for (name, type) in COLUMNS:
+			if name not in existing:
+				dbc.execute("alter table oprecord add column %s %s"%(name, type))
+		# databases created before inputs were indexed acquire the index when next opened
+		dbc.execute("create index if not exists oprecord_inpath on oprecord (inpath)")
+		dbc.execute("create index if not exists oprecord_identity on oprecord (inino, indev)")
+		dbc.commit()
 		return dbc
 
 	def check(self, inpath, mtime, opname=None):
 		"Checks if if an output file has been created for an input file with a name and creation time, returning the outpath or None"
+		r = self.lookup(inpath, mtime, opname)
+		return r and r.outpath
+
+	def lookup(self, inpath, mtime, opname=None):
+		"Returns the Record of an output file created for an input file with a name and creation time, or None"
 		cur = self.dbc.cursor()
+		fields = ", ".join(FIELDS)
 		if opname:
-			cur.execute("select outpath from oprecord where inpath=:inpath and inmtime=:mtime and opname=:opname", {"inpath": inpath, "mtime":mtime, "opname":opname})
+			cur.execute("select %s from oprecord where inpath=:inpath and inmtime=:mtime and opname=:opname"%fields, {"inpath": inpath, "mtime":mtime, "opname":opname})
 		else:
-			cur.execute("select outpath from oprecord where inpath=:inpath and inmtime=:mtime", {"inpath": inpath, "mtime":mtime})
+			cur.execute("select %s from oprecord where inpath=:inpath and inmtime=:mtime"%fields, {"inpath": inpath, "mtime":mtime})
 		r = cur.fetchone()
-		return r and r[0]
+		return r and Record(*r)
+
+	def lookup_output(self, outpath):
+		"Returns the Record of the output file with the path given, or None"
+		r = self.dbc.execute("select %s from oprecord where outpath=?"%", ".join(FIELDS), (outpath,)).fetchone()
+		return r and Record(*r)
 
-	def record(self, inpath, inmtime, outpath, outmtime, opname=None, timestamp=None):
-		"Record the processing of a file"
+	def lookup_identity(self, identity, mtime):
+		"Returns the Records of the output files created for an input file with an identity (a (device, inode, size) tuple) and creation time"
+		(dev, ino, size) = identity
+		cur = self.dbc.cursor()
+		cur.execute("select %s from oprecord where inino=? and indev=? and insize=? and inmtime=?"%", ".join(FIELDS), (ino, dev, size, mtime))
+		return [Record(*r) for r in cur.fetchall()]
+
+	def record(self, inpath, inmtime, outpath, outmtime, opname=None, timestamp=None, outsize=None, commit=True, identity=None):
+		"""
+		Record the processing of a file. If commit is false, the record is not
+		committed until commit() is next called. identity is the input file's
+		(device, inode, size), if known.
+		"""
 		timestamp = int(timestamp or time.time())
 		cur = self.dbc.cursor()
 		cur.execute("DELETE FROM oprecord WHERE OUTPATH=?", (outpath,))
-		cur.execute("INSERT INTO oprecord VALUES (?, ?, ?, ?, ?, ?)", (inpath, inmtime, outpath, outmtime, opname, timestamp))
+		cur.execute("INSERT INTO oprecord (%s) VALUES (%s)"%(", ".join(FIELDS), ", ".join("?"*len(FIELDS))), Record(inpath, inmtime, outpath, outmtime, opname, timestamp, outsize, *(identity or (None, None, None))))
+		if commit:
+			self.dbc.commit()
+
+	def record_identity(self, outpath, identity, commit=True):
+		"Record the identity (a (device, inode, size) tuple) of the input file of an output recorded without one"
+		(dev, ino, size) = identity
+		self.dbc.execute("UPDATE oprecord SET indev=?, inino=?, insize=? WHERE outpath=?", (dev, ino, size, outpath))
+		if commit:
+			self.dbc.commit()
+
+	def commit(self):
+		"Commit any records made with commit=False"
 		self.dbc.commit()
 
 	def most_recently_processed(self):
@@ -42,3 +107,69 @@ class ProvenanceTracker:
 		cur.execute("SELECT inpath FROM oprecord ORDER BY rowid DESC LIMIT 1")
 		r = cur.fetchone()
 		return r and r[0]
+
+	def count(self):
+		"Return the number of records"
+		return self.dbc.execute("SELECT count(*) FROM oprecord").fetchone()[0]
+
+	def records(self, inprefix=None, outpath=None, since=None, until=None, batch_size=1000, order=None):
+		"""
+		Yield the Records matching all of the criteria given:
+		- inprefix: the input path, or that of a directory containing it
+		- outpath: the output path
+		- since, until: the range of times (in seconds since the epoch) at which the processing was recorded, inclusive of since and exclusive of until
+		Records are yielded in the order in which they were made, or, if inprefix is given, in order of their input paths. If order is 'inpath' or 'outpath', they are yielded in order of that path, so that those in each directory come together.
+		Records are fetched in batches of batch_size, so the table is never read into memory in one go, and it may be modified between batches (for example, by deleting the records yielded).
+		"""
+		conditions, params = [], {"limit": batch_size}
+		if inprefix:
+			inprefix = inprefix.rstrip('/')
+			# '0' is the character after '/', so this range contains the prefix and everything under it
+			conditions.append("inpath >= :lo AND inpath < :hi")
+			params.update(lo=inprefix, hi=inprefix+'0')
+		# the column to continue from in the next batch, as well as the rowid
+		if order == 'outpath':
+			(order, after, key) = ("outpath", "outpath > :lastkey", FIELDS.index("outpath"))
+		elif inprefix or order == 'inpath':
+			(order, after, key) = ("inpath, rowid", "(inpath, rowid) > (:lastkey, :lastrowid)", FIELDS.index("inpath"))
+		else:
+			(order, after, key) = ("rowid", "rowid > :lastrowid", None)
+		if outpath is not None:
+			conditions.append("outpath = :outpath")
+			params["outpath"] = outpath
+		if since is not None:
+			conditions.append("timestamp >= :since")
+			params["since"] = since
+		if until is not None:
+			conditions.append("timestamp < :until")
+			params["until"] = until
+		query = "SELECT rowid, " + ", ".join(FIELDS) + " FROM oprecord WHERE %s ORDER BY %s LIMIT :limit"
+		params.update(lastkey=None, lastrowid=None)
+		while True:
+			where = " AND ".join(conditions + (params["lastrowid"] is not None and [after] or [])) or "1"
+			cur = self.dbc.cursor()
+			cur.execute(query%(where, order), params)
+			rows = cur.fetchall()
+			for row in rows:
+				record = Record(*row[1:])
+				if inprefix and not (record.inpath == inprefix or record.inpath.startswith(inprefix+'/')):
+					continue
+				yield record
+			if len(rows) < batch_size:
+				return
+			params.update(lastkey=key is not None and rows[-1][key+1] or None, lastrowid=rows[-1][0])
+
+	def delete(self, outpaths):
+		"Delete the records of the outputs with the paths given"
+		cur = self.dbc.cursor()
+		cur.executemany("DELETE FROM oprecord WHERE outpath=?", ((p,) for p in outpaths))
+		self.dbc.commit()
+
+	def vacuum(self):
+		"Rebuild the database file, reclaiming the space left by deleted records"
+		self.dbc.execute("VACUUM")
+
+	def analyze(self):
+		"Update the statistics the query planner uses"
+		self.dbc.execute("ANALYZE")
+		self.dbc.commit()
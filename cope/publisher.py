@@ -0,0 +1,146 @@
+import os
+import os.path
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+
+def _load_syncfs():
+	try:
+		return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).syncfs
+	except (OSError, AttributeError):
+		return None
+
+_syncfs = _load_syncfs()
+
+def syncfs(path):
+	"""
+	Flush all pending writes on the filesystem containing path to stable
+	storage. This uses the Linux syncfs() call where available, and falls
+	back to sync() elsewhere.
+	"""
+	if _syncfs is not None:
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			if _syncfs(fd) == 0:
+				return
+		finally:
+			os.close(fd)
+	os.sync()
+
+def fsync_dir(path):
+	"Make the entries of a directory durable"
+	fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+class OutputPublisher:
+	"""
+	Publishes output files atomically and durably, in batches.
+
+	Each output is written at a temporary path alongside its final one. When a
+	batch is committed, the filesystem is synced once, the outputs are renamed
+	into place, their directories are synced and their provenance records are
+	committed, so that outputs and records are published together, and a crash
+	never leaves a truncated file at an output's final path.
+
+	A run holds an exclusive lock on a marker file in the metadata directory
+	from begin() until end(), and marks it while temporary files may exist. If
+	it is found marked when a run begins, the previous run did not finish, and
+	the temporary files it left are removed; a run in progress holds the lock,
+	so its files are never mistaken for these.
+	"""
+	TEMP_PREFIX = ".cope-tmp-"
+	MARKER = "publishing"
+
+	def __init__(self, destpath, metadatarepository, batch_size=100):
+		self.destpath = destpath
+		self.metadatarepository = metadatarepository
+		self.batch_size = batch_size
+		# (temporary path, final path, recording arguments) tuples awaiting commit
+		self.pending = []
+		self.markerpath = os.path.join(metadatarepository.dirpath, OutputPublisher.MARKER)
+		# the descriptor of the locked marker file, while a run is in progress
+		self.markerfd = None
+		self.marked = False
+
+	def begin(self):
+		"""
+		Lock the destination for a run, removing any temporary files left by
+		an earlier one which did not finish. This raises BlockingIOError if
+		another run holds the lock.
+		"""
+		fd = os.open(self.markerpath, os.O_RDWR | os.O_CREAT)
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			os.close(fd)
+			raise BlockingIOError(errno.EWOULDBLOCK, "another run is publishing to %s"%self.destpath)
+		self.markerfd = fd
+		if os.fstat(fd).st_size:
+			self.sweep()
+
+	def end(self):
+		"Release the lock taken by begin()"
+		if self.markerfd is not None:
+			os.close(self.markerfd)
+			self.markerfd = None
+
+	def sweep(self):
+		"Remove any temporary files left under the destination, returning how many there were; this is only safe between begin() and end()"
+		count = 0
+		for (dirpath, dirnames, filenames) in os.walk(self.destpath):
+			for filename in filenames:
+				if filename.startswith(OutputPublisher.TEMP_PREFIX):
+					os.remove(os.path.join(dirpath, filename))
+					count += 1
+		os.ftruncate(self.markerfd, 0)
+		return count
+
+	def temp_path_for(self, fdestpath):
+		"Return the temporary path an output is to be written at before publication"
+		# an output which is still pending must be published before it is rewritten
+		if any(p[1] == fdestpath for p in self.pending):
+			self.commit()
+		if not self.marked:
+			os.pwrite(self.markerfd, b"1", 0)
+			self.marked = True
+		(dirname, basename) = os.path.split(fdestpath)
+		return os.path.join(dirname, OutputPublisher.TEMP_PREFIX + basename)
+
+	def stage(self, ftemppath, fdestpath, inpath, inmtime, outpath, opname=None, identity=None):
+		"Queue a successfully written output for publication, committing the batch if it is full"
+		self.pending.append((ftemppath, fdestpath, (inpath, inmtime, outpath, opname, identity)))
+		if len(self.pending) >= self.batch_size:
+			self.commit()
+
+	def discard(self, ftemppath):
+		"Remove whatever a failed process left at a temporary path"
+		try:
+			os.remove(ftemppath)
+		except FileNotFoundError:
+			pass
+
+	def commit(self):
+		"Publish all pending outputs and commit their provenance records"
+		if self.pending:
+			self._publish()
+		if self.marked:
+			# no temporary files remain until the next is asked for
+			os.ftruncate(self.markerfd, 0)
+			self.marked = False
+
+	def _publish(self):
+		syncfs(self.destpath)
+		dirs = set()
+		for (ftemppath, fdestpath, (inpath, inmtime, outpath, opname, identity)) in self.pending:
+			os.replace(ftemppath, fdestpath)
+			dirs.add(os.path.dirname(fdestpath))
+			st = os.stat(fdestpath)
+			self.metadatarepository.record_product(inpath, inmtime, outpath, int(st.st_mtime*1000000), opname, outsize=st.st_size, commit=False, identity=identity)
+		for d in dirs:
+			fsync_dir(d)
+		self.metadatarepository.commit()
+		self.pending = []
@@ -0,0 +1,93 @@
+import heapq
+import os
+import os.path
+from collections import deque
+
+def _reordered(paths, key, window):
+	"Yield paths in ascending order of key, looking at most window paths ahead, or at all of them if window is None"
+	if window is None:
+		yield from (p for (k, seq, p) in sorted((key(p), seq, p) for (seq, p) in enumerate(paths)))
+		return
+	heap = []
+	for (seq, path) in enumerate(paths):
+		heapq.heappush(heap, (key(path), seq, path))
+		if len(heap) >= window:
+			yield heapq.heappop(heap)[2]
+	while heap:
+		yield heapq.heappop(heap)[2]
+
+def _stat_key(path, fn):
+	def key(relpath):
+		try:
+			return fn(os.stat(os.path.join(path, relpath)))
+		except OSError:
+			return 0
+	return key
+
+class Schedule:
+	"""
+	A namespace containing scheduling policies, which determine the order in
+	which files are processed. A scheduling policy takes an iterator function
+	and returns another, which yields the same paths in a different order.
+	"""
+
+	@staticmethod
+	def newestFirst(window=10000):
+		"""
+		Process the most recently modified files first. Files are reordered
+		within a window of the given number of files ahead of the traversal,
+		so the memory used is bounded, but a file is only moved ahead of those
+		within the window of it: the order is only approximate. If window is
+		None, the whole tree is instead traversed and its files sorted before
+		any is processed, so the memory used grows with the size of the tree.
+		"""
+		def schedule(iterator):
+			def iter(path, **kw):
+				return _reordered(iterator(path, **kw), _stat_key(path, lambda st: -st.st_mtime), window)
+			return iter
+		return schedule
+
+	@staticmethod
+	def smallestFirst(window=10000):
+		"""
+		Process the smallest files first, reordering within a window or over
+		the whole tree as newestFirst does.
+		"""
+		def schedule(iterator):
+			def iter(path, **kw):
+				return _reordered(iterator(path, **kw), _stat_key(path, lambda st: st.st_size), window)
+			return iter
+		return schedule
+
+	@staticmethod
+	def fairShare():
+		"""
+		Share processing between the top-level subdirectories of the source
+		tree, taking one file from each in turn, so that no one subdirectory
+		can starve the others. Each top-level subdirectory is traversed by its
+		own iterator, with limit_to, so the iterator must support this (as
+		DirectoryTreeIterator does); it alone decides which paths are yielded
+		under them, so any directories it excludes are skipped. Files at the
+		top level, which the iterators here do not filter, are taken from the
+		listing of the top level, and treated as one more subdirectory. When the iterator is asked to start
+		from or be limited to a particular path, files are yielded in the
+		iterator's own order.
+		"""
+		def schedule(iterator):
+			def iter(path, **kw):
+				if kw:
+					yield from iterator(path, **kw)
+					return
+				names = sorted(os.listdir(path))
+				dirs = set(n for n in names if os.path.isdir(os.path.join(path, n)))
+				files = (n for n in names if n not in dirs)
+				cursors = deque([files])
+				cursors.extend(iterator(path, limit_to=n) for n in names if n in dirs)
+				while cursors:
+					cursor = cursors.popleft()
+					for relpath in cursor:
+						yield relpath
+						cursors.append(cursor)
+						break
+			return iter
+		return schedule
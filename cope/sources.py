@@ -0,0 +1,235 @@
+""" Sources of input files live here
+
+A source provides FileProcessor with its input files. The default source is
+a directory tree in the filesystem; ArchiveSource allows the members of tar
+and zip archives to be processed without extracting the archives first.
+
+A source has the following methods:
+- iterate(start=None, stop=None, limit_to=None): return a generator of the
+  relative paths of the input files, with the arguments as for
+  DirectoryTreeIterator
+- stat(relpath): return an object with st_mtime and st_size attributes for an
+  input file, or None if it does not exist
+- path(relpath): return the path of an input file in the filesystem
+- open(relpath): return a binary file object reading an input file
+"""
+
+import io
+import os
+import os.path
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from .iterators.directorytree import DirectoryTreeIterator
+
+class FilesystemSource:
+	"""
+	A source consisting of a directory tree in the filesystem, traversed with
+	an iterator function
+	"""
+	def __init__(self, srcpath, iterator):
+		self.srcpath = srcpath
+		self.iterator = iterator
+
+	def iterate(self, **kw):
+		return self.iterator(self.srcpath, **kw)
+
+	def stat(self, relpath):
+		try:
+			return os.stat(self.path(relpath))
+		except OSError:
+			return None
+
+	def path(self, relpath):
+		return os.path.join(self.srcpath, relpath)
+
+	def open(self, relpath):
+		return open(self.path(relpath), 'rb')
+
+MemberStat = namedtuple('MemberStat', ['st_mtime', 'st_size'])
+
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+
+def _split(path):
+	return path and path.rstrip('/').split('/') or None
+
+def _is_under(segments, prefix):
+	return segments[:len(prefix)] == prefix
+
+class _TeeReader(io.RawIOBase):
+	"""
+	A reader of an archive member which can only be read once, which writes
+	what it reads to a file, so that the member can be read again from there
+	"""
+	def __init__(self, fi, fo):
+		self.fi = fi
+		self.fo = fo
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		n = self.fi.readinto(b)
+		self.fo.write(memoryview(b)[:n])
+		return n
+
+	def finish(self):
+		"Copy the rest of the member to the file, and close both"
+		shutil.copyfileobj(self.fi, self.fo)
+		self.discard()
+
+	def discard(self):
+		self.fi.close()
+		self.fo.close()
+
+class ArchiveSource:
+	"""
+	A source consisting of the members of a tar or zip archive, or of all the
+	archives in a directory tree. The relative path of a member of an archive
+	in a directory is the archive's relative path followed by the member's
+	path within it (i.e., "2024/drop17.tar/images/0001.jpg"); that of a member
+	of a single archive is simply its path within the archive.
+
+	Tar archives are read in a single sequential pass, and members are only
+	extracted (to a temporary file, removed once the next member is reached)
+	if a path to them is requested; processing functions wrapped with
+	Process.fromStream read members directly from the archive instead. A tar
+	member read more than once (i.e., for its digest and then to process it)
+	is copied to the temporary file as it is first read, and read from there
+	subsequently. Consequently, only the member most recently yielded by
+	iterate() may be accessed. Members are yielded in the order they appear
+	in each archive.
+
+	The modification time of a member is taken to be that of its archive, if
+	later, so that the members of an archive which is replaced are processed
+	again.
+	"""
+	def __init__(self, path, include_archive=lambda n: n.lower().endswith(ARCHIVE_SUFFIXES)):
+		"""
+		The arguments are:
+		- path: the path of an archive, or of a directory containing archives
+		- include_archive: when path is a directory, a function determining from its relative path whether a file is an archive to read
+		"""
+		self.archivepath = path
+		self.include_archive = include_archive
+		self.tempdir = None
+		# the relative path, member and reader of the member most recently yielded
+		self.current = None
+		self.extracted = None
+		# the _TeeReader of a tar member which has been opened
+		self.tee = None
+
+	def _archives(self):
+		if os.path.isfile(self.archivepath):
+			return [(None, self.archivepath)]
+		return [(rel, os.path.join(self.archivepath, rel)) for rel in DirectoryTreeIterator()(self.archivepath) if self.include_archive(rel)]
+
+	def _members(self, path):
+		"Yield (member path, MemberStat, reader function, whether the reader may only be used once) tuples for the regular files in an archive"
+		archive_mtime = os.stat(path).st_mtime
+		if zipfile.is_zipfile(path):
+			with zipfile.ZipFile(path) as zf:
+				for info in zf.infolist():
+					if info.is_dir():
+						continue
+					mtime = time.mktime(info.date_time + (0, 0, -1))
+					yield (os.path.normpath(info.filename), MemberStat(max(mtime, archive_mtime), info.file_size), lambda info=info: zf.open(info), False)
+		else:
+			with tarfile.open(path, mode='r|*') as tf:
+				for member in tf:
+					if not member.isfile():
+						continue
+					yield (os.path.normpath(member.name), MemberStat(max(member.mtime, archive_mtime), member.size), lambda member=member: tf.extractfile(member), True)
+
+	def iterate(self, start=None, stop=None, limit_to=None):
+		if limit_to:
+			start = None
+			stop = None
+		start, stop, limit_to = _split(start), _split(stop), _split(limit_to)
+		self.tempdir = tempfile.mkdtemp(prefix="cope-archive-")
+		stopping = False
+		try:
+			for (relarchive, path) in self._archives():
+				prefix = relarchive and relarchive.split('/') or []
+				if start:
+					if prefix < start[:len(prefix)]:
+						continue
+					if not _is_under(start, prefix):
+						# the starting member would have been in an earlier archive
+						start = None
+				if stop and prefix and prefix > stop[:len(prefix)]:
+					break
+				if limit_to and not (_is_under(prefix, limit_to) or _is_under(limit_to, prefix)):
+					continue
+				for (name, st, reader, once) in self._members(path):
+					segments = prefix + name.split('/')
+					if limit_to and not _is_under(segments, limit_to):
+						continue
+					if start:
+						# members are not sorted, so seek to the starting one by position
+						if not _is_under(segments, start):
+							continue
+						start = None
+					if stop:
+						if _is_under(segments, stop):
+							stopping = True
+						elif stopping:
+							return
+					self._release()
+					relpath = "/".join(segments)
+					self.current = (relpath, st, reader, once)
+					yield relpath
+		finally:
+			self._release()
+			self.current = None
+			shutil.rmtree(self.tempdir, ignore_errors=True)
+
+	def _release(self):
+		if self.tee:
+			self.tee.discard()
+			self.tee = None
+			os.remove(self._extraction_path(self.current[0]))
+		if self.extracted:
+			os.remove(self.extracted)
+			self.extracted = None
+
+	def _extraction_path(self, relpath):
+		return os.path.join(self.tempdir, os.path.basename(relpath))
+
+	def _current(self, relpath):
+		if not self.current or self.current[0] != relpath:
+			raise ValueError("%s is not the archive member being processed"%relpath)
+		return self.current
+
+	def stat(self, relpath):
+		if not self.current or self.current[0] != relpath:
+			return None
+		return self.current[1]
+
+	def path(self, relpath):
+		(relpath, st, reader, once) = self._current(relpath)
+		if not self.extracted:
+			extracted = self._extraction_path(relpath)
+			if self.tee:
+				# the member has been partly read already, with what was read copied here
+				self.tee.finish()
+				self.tee = None
+			else:
+				with reader() as fi:
+					with open(extracted, 'wb') as fo:
+						shutil.copyfileobj(fi, fo)
+			os.utime(extracted, (st.st_mtime, st.st_mtime))
+			self.extracted = extracted
+		return self.extracted
+
+	def open(self, relpath):
+		(relpath, st, reader, once) = self._current(relpath)
+		if self.extracted or self.tee:
+			return open(self.path(relpath), 'rb')
+		if once:
+			self.tee = _TeeReader(reader(), open(self._extraction_path(relpath), 'wb'))
+			return io.BufferedReader(self.tee)
+		return reader()
@@ -0,0 +1,64 @@
+import os
+import time
+
+class PressureThrottle:
+	"""
+	Holds processing back while the host is under pressure, so that batch
+	processing does not starve latency-sensitive services sharing it.
+
+	Pressure is read from Linux pressure stall information (PSI), as the
+	percentage of the last ten seconds in which some tasks were stalled
+	waiting for any of the resources given. Where PSI is not available, the
+	one-minute load average is compared against max_load instead.
+	"""
+	def __init__(self, max_pressure=20.0, resources=('io', 'cpu'), max_load=None, check_interval=1.0, min_delay=0.5, max_delay=30.0, max_wait=300.0):
+		"""
+		The arguments are:
+		- max_pressure: the stall percentage above which processing is held back
+		- resources: the PSI resources to examine (any of 'io', 'cpu' and 'memory')
+		- max_load: the load average above which processing is held back where PSI is unavailable; this defaults to the number of CPUs
+		- check_interval: the minimum time in seconds between checks of the pressure, so that checking costs little when processing many small files
+		- min_delay, max_delay: the bounds of the time to wait before checking again; the delay doubles for as long as the pressure remains high
+		- max_wait: the longest time to hold processing back for at once, after which it proceeds regardless
+		"""
+		self.max_pressure = max_pressure
+		self.resources = resources
+		self.max_load = max_load or os.cpu_count() or 1
+		self.check_interval = check_interval
+		self.min_delay = min_delay
+		self.max_delay = max_delay
+		self.max_wait = max_wait
+		self.last_check = None
+
+	def pressure(self):
+		"Return the highest current stall percentage of the resources, or None if PSI is unavailable"
+		values = []
+		for resource in self.resources:
+			try:
+				with open("/proc/pressure/%s"%resource) as f:
+					for line in f:
+						if line.startswith("some "):
+							fields = dict(field.split("=") for field in line.split()[1:])
+							values.append(float(fields["avg10"]))
+			except (OSError, KeyError, ValueError):
+				return None
+		return values and max(values) or 0.0
+
+	def overloaded(self):
+		"Return whether the host is currently under more pressure than the limit"
+		pressure = self.pressure()
+		if pressure is not None:
+			return pressure > self.max_pressure
+		return os.getloadavg()[0] > self.max_load
+
+	def wait(self):
+		"Called before each item is processed; waits for as long as the host is overloaded"
+		now = time.monotonic()
+		if self.last_check is not None and now - self.last_check < self.check_interval:
+			return
+		delay = self.min_delay
+		deadline = now + self.max_wait
+		while self.overloaded() and time.monotonic() < deadline:
+			time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+			delay = min(delay*2, self.max_delay)
+		self.last_check = time.monotonic()
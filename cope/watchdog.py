@@ -0,0 +1,122 @@
+import os
+import pickle
+import select
+import signal
+import time
+
+# the process groups of external processes started (by the process helpers)
+# in this process, which are killed along with it if it is timed out
+process_groups = set()
+
+# the time a timed-out child has to kill its process groups before it is
+# killed itself
+GRACE_PERIOD = 1.0
+
+def _terminate(signum, frame):
+	for pgid in list(process_groups):
+		try:
+			os.killpg(pgid, signal.SIGKILL)
+		except ProcessLookupError:
+			pass
+	os._exit(1)
+
+def _wait(pid, timeout):
+	"Wait up to timeout seconds for a child process to exit, returning its status, or None if it has not"
+	deadline = time.monotonic() + timeout
+	while True:
+		(waited, status) = os.waitpid(pid, os.WNOHANG)
+		if waited:
+			return status
+		if time.monotonic() >= deadline:
+			return None
+		time.sleep(0.01)
+
+def _kill(pid):
+	"Kill a child and its process group, giving it the chance to kill the process groups it started first, and return its status"
+	for sig in [signal.SIGTERM, signal.SIGKILL]:
+		try:
+			os.killpg(pid, sig)
+		except ProcessLookupError:
+			pass
+		status = _wait(pid, GRACE_PERIOD)
+		if status is not None:
+			return status
+	return os.waitpid(pid, 0)[1]
+
+def call_with_timeout(fn, args, timeout, limits=None):
+	"""
+	Call fn with the arguments given in a forked child process, in a process
+	group of its own, and wait for it to finish. If it takes longer than
+	timeout seconds (if not None), the child and any processes it started are
+	killed, and TimeoutError is raised; they are likewise killed if waiting
+	is interrupted by an exception. If limits (a ResourceLimits) is given,
+	they are applied to the child before fn is called. Any exception raised by fn is raised again here;
+	anything else fn does (such as modifying objects) does not affect the
+	calling process.
+
+	The child is forked, not started afresh, so only the calling thread
+	exists in it, and any locks other threads held when it was forked stay
+	held there. fn must therefore not use anything other threads of the
+	calling process may be using (such as their logging handlers, queues or
+	SQLite connections), or it may deadlock.
+	"""
+	(r, w) = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		status = 1
+		try:
+			os.close(r)
+			os.setpgid(0, 0)
+			process_groups.clear()
+			signal.signal(signal.SIGTERM, _terminate)
+			try:
+				if limits:
+					limits.apply()
+				fn(*args)
+				status = 0
+			except BaseException as e:
+				try:
+					data = pickle.dumps(e)
+					pickle.loads(data)
+				except Exception:
+					# not every exception can be passed back as it is
+					data = pickle.dumps(Exception(repr(e)))
+				with os.fdopen(w, 'wb') as f:
+					f.write(data)
+		finally:
+			os._exit(status)
+
+	os.close(w)
+	try:
+		# also set the child's process group here, in case it is killed before doing so
+		os.setpgid(pid, pid)
+	except OSError:
+		pass
+	deadline = timeout is not None and time.monotonic() + timeout or None
+	data = b''
+	timed_out = False
+	try:
+		with os.fdopen(r, 'rb', buffering=0) as f:
+			# the child's end of the pipe closes when it exits
+			while True:
+				remaining = deadline and deadline - time.monotonic()
+				if (remaining is not None and remaining <= 0) or not select.select([f], [], [], remaining)[0]:
+					timed_out = True
+					break
+				chunk = f.read(65536)
+				if not chunk:
+					break
+				data += chunk
+	except BaseException:
+		_kill(pid)
+		raise
+	if timed_out:
+		status = _kill(pid)
+	else:
+		(_, status) = os.waitpid(pid, 0)
+	if timed_out:
+		raise TimeoutError("processing took longer than %s seconds"%timeout)
+	if data:
+		raise pickle.loads(data)
+	if status != 0:
+		raise ChildProcessError("processing exited with status %d"%status)
@@ -0,0 +1,158 @@
+import unittest
+import io
+import os
+import os.path
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from cope import FileProcessor, Process, ArchiveSource, ProductCache
+
+class ArchiveSourceTests(unittest.TestCase):
+
+	def createTar(self, path, members, mode="w"):
+		"""Create a tar archive containing a list of (name, contents) members"""
+		with tarfile.open(path, mode) as tf:
+			for (name, contents) in members:
+				info = tarfile.TarInfo(name)
+				info.size = len(contents)
+				info.mtime = 1700000000
+				tf.addfile(info, io.BytesIO(contents))
+
+	def createZip(self, path, members):
+		"""Create a zip archive containing a list of (name, contents) members"""
+		with zipfile.ZipFile(path, "w") as zf:
+			for (name, contents) in members:
+				zf.writestr(name, contents)
+
+	def contentsOfOutputFile(self, path):
+		with open(os.path.join(self.outtree, path), "rb") as f:
+			return f.read()
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.intree = os.path.join(self.tempdir, "in")
+		self.outtree = os.path.join(self.tempdir, "out")
+		os.makedirs(os.path.join(self.intree, "2024"))
+		os.makedirs(self.outtree)
+		self.createTar(os.path.join(self.intree, "2024/a.tar.gz"), [("x/2", b"two"), ("x/1", b"one")], "w:gz")
+		self.createZip(os.path.join(self.intree, "b.zip"), [("y/3", b"three")])
+		with open(os.path.join(self.intree, "README"), "w") as f:
+			f.write("not an archive")
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_processArchives(self):
+		"""
+		Given a directory of archives
+		When a FileProcessor is run with an ArchiveSource
+		Then the archives' members should be processed in archive order, and not reprocessed subsequently
+		"""
+		proc = FileProcessor(ArchiveSource(self.intree), self.outtree, Process.copy)
+		log = proc.run()
+		self.assertEqual(log.processed, [("2024/a.tar.gz/x/2", "2024/a.tar.gz/x/2"), ("2024/a.tar.gz/x/1", "2024/a.tar.gz/x/1"), ("b.zip/y/3", "b.zip/y/3")])
+		self.assertEqual(log.failed, [])
+		self.assertEqual(self.contentsOfOutputFile("2024/a.tar.gz/x/1"), b"one")
+		self.assertEqual(self.contentsOfOutputFile("b.zip/y/3"), b"three")
+		log2 = proc.run()
+		self.assertEqual(log2.processed, [])
+		self.assertEqual(len(log2.already_present), 3)
+
+	def test_streaming(self):
+		"""
+		Given a single archive
+		When a FileProcessor is run with an ArchiveSource and a processing function wrapped with Process.fromStream
+		Then the function should be given readers of the members
+		"""
+		def process(fi, dest):
+			with open(dest, "wb") as fo:
+				fo.write(fi.read().upper())
+		proc = FileProcessor(ArchiveSource(os.path.join(self.intree, "2024/a.tar.gz")), self.outtree, Process.fromStream(process))
+		log = proc.run()
+		self.assertEqual(log.processed, [("x/2", "x/2"), ("x/1", "x/1")])
+		self.assertEqual(self.contentsOfOutputFile("x/2"), b"TWO")
+
+	def test_plan(self):
+		"""
+		Given a directory of archives
+		When plans are made before and after some of their members are processed
+		Then the plans should count the members outstanding and their sizes
+		"""
+		proc = FileProcessor(ArchiveSource(self.intree), self.outtree, Process.copy)
+		self.assertEqual(proc.plan(), FileProcessor.Plan(pending=3, pending_bytes=11, already_present=0))
+		proc.run(max_items=1)
+		self.assertEqual(proc.plan(), FileProcessor.Plan(pending=2, pending_bytes=8, already_present=1))
+
+	def test_batchFunctionsRejected(self):
+		"The batch forms of the filtering and naming functions cannot be used with an ArchiveSource, whose members are gone by the time a directory has been listed"
+		for kw in [{"includenames": lambda ps: ps}, {"includefiles": lambda ps: ps}, {"destnames": lambda ps: ps}]:
+			with self.assertRaises(ValueError):
+				FileProcessor(ArchiveSource(self.intree), self.outtree, Process.copy, **kw)
+
+	def test_streamingWithTimeout(self):
+		"""
+		Given an archive with members in subdirectories
+		When a FileProcessor is run with an ArchiveSource, a timeout and a processing function wrapped with Process.fromStream
+		Then the function should be given readers of the members in the child process
+		"""
+		def process(fi, dest):
+			with open(dest, "wb") as fo:
+				fo.write(fi.read().upper())
+		proc = FileProcessor(ArchiveSource(self.intree), self.outtree, Process.fromStream(process), timeout=30)
+		log = proc.run()
+		self.assertEqual(log.failed, [])
+		self.assertEqual(len(log.processed), 3)
+		self.assertEqual(self.contentsOfOutputFile("2024/a.tar.gz/x/1"), b"ONE")
+		self.assertEqual(self.contentsOfOutputFile("b.zip/y/3"), b"THREE")
+
+	def test_seeking(self):
+		source = ArchiveSource(self.intree)
+		self.assertEqual(list(source.iterate(limit_to="b.zip")), ["b.zip/y/3"])
+		self.assertEqual(list(source.iterate(start="2024/a.tar.gz/x/1")), ["2024/a.tar.gz/x/1", "b.zip/y/3"])
+		self.assertEqual(list(source.iterate(stop="2024/a.tar.gz/x/2")), ["2024/a.tar.gz/x/2"])
+
+	def test_replacedArchive(self):
+		"""
+		Given a directory of archives whose members have been processed
+		When an archive is replaced by one whose members have the same paths and modification times
+		Then those members should be processed again
+		"""
+		proc = FileProcessor(ArchiveSource(self.intree), self.outtree, Process.copy)
+		proc.run()
+		archive = os.path.join(self.intree, "2024/a.tar.gz")
+		self.createTar(archive, [("x/2", b"TWO"), ("x/1", b"ONE")], "w:gz")
+		st = os.stat(archive)
+		os.utime(archive, (st.st_atime, st.st_mtime + 10))
+		log = proc.run()
+		self.assertEqual(log.processed, [("2024/a.tar.gz/x/2", "2024/a.tar.gz/x/2"), ("2024/a.tar.gz/x/1", "2024/a.tar.gz/x/1")])
+		self.assertEqual(self.contentsOfOutputFile("2024/a.tar.gz/x/1"), b"ONE")
+
+	def test_withCache(self):
+		"""
+		Given a tar archive containing two members with the same content
+		When a FileProcessor with a ProductCache is run with an ArchiveSource, streaming the members or given their paths
+		Then each member should be read in full to process it after its digest is taken, and the second member's output should come from the cache
+		"""
+		archive = os.path.join(self.tempdir, "c.tar.gz")
+		self.createTar(archive, [("1", b"same"), ("2", b"same"), ("3", b"other")], "w:gz")
+		calls = []
+		def stream(fi, dest):
+			calls.append(dest)
+			with open(dest, "wb") as fo:
+				fo.write(fi.read())
+		def copy(src, dest):
+			calls.append(dest)
+			shutil.copyfile(src, dest)
+		for (n, process) in enumerate([Process.fromStream(stream), copy]):
+			del calls[:]
+			outtree = os.path.join(self.tempdir, "out%d"%n)
+			cache = ProductCache(os.path.join(self.tempdir, "cache%d"%n), "copy")
+			log = FileProcessor(ArchiveSource(archive), outtree, process, cache=cache).run()
+			self.assertEqual(log.failed, [])
+			self.assertEqual(len(log.processed), 3)
+			self.assertEqual(len(calls), 2)
+			for (name, contents) in [("1", b"same"), ("2", b"same"), ("3", b"other")]:
+				with open(os.path.join(outtree, name), "rb") as f:
+					self.assertEqual(f.read(), contents)
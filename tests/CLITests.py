@@ -0,0 +1,98 @@
+import unittest
+import io
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
+
+from cope import cli
+
+CONFIG = """
+import cope
+
+def destname(path):
+	if path.endswith(".skip"):
+		raise Exception("destname should not be called")
+	return path
+
+processor = cope.FileProcessor(%r, %r, cope.Process.copy, destname)
+"""
+
+class CLITests(unittest.TestCase):
+
+	def createTree(self, base, files):
+		for (path, contents) in files:
+			fpath = os.path.join(base, path)
+			os.makedirs(os.path.dirname(fpath), exist_ok=True)
+			with open(fpath, "w") as f:
+				f.write(contents)
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.intree = os.path.join(self.tempdir, "in")
+		self.outtree = os.path.join(self.tempdir, "out")
+		self.config = os.path.join(self.tempdir, "config.py")
+		with open(self.config, "w") as f:
+			f.write(CONFIG%(self.intree, self.outtree))
+		self.createTree(self.intree, [
+			("01/a", "aaaa"),
+			("01/b", "bbbbbb"),
+			("02/c", "cc"),
+		])
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def main(self, *args):
+		out = io.StringIO()
+		with redirect_stdout(out), redirect_stderr(io.StringIO()):
+			status = cli.main(list(args) + [self.config, "--json"])
+		return (status, json.loads(out.getvalue()))
+
+	def test_run(self):
+		"""
+		Given a FileProcessor defined in a file
+		When it is run from the command line with run options
+		Then it should be run with those options, and the numbers of files handled reported
+		"""
+		(status, result) = self.main("run", "--max-items", "2")
+		self.assertEqual(status, 0)
+		self.assertEqual(result, {"processed": 2, "already_present": 0, "unnameable": 0, "failed": 0, "timed_out": 0, "collisions": 0, "moved": 0})
+		(status, result) = self.main("run")
+		self.assertEqual(result["processed"], 1)
+		self.assertEqual(result["already_present"], 2)
+
+	def test_statusAndPlan(self):
+		"""
+		Given a partially processed tree
+		When the status and plan commands are run
+		Then they should report the files processed and outstanding, without naming any
+		"""
+		self.main("run", "--max-items", "1")
+		self.createTree(self.intree, [("03/d.skip", "d")])
+		(status, result) = self.main("status")
+		self.assertEqual(status, 0)
+		self.assertEqual(result["products"], 1)
+		self.assertEqual(result["last_processed"], "01/a")
+		self.assertEqual(result["last_run_processed"], 1)
+		(status, result) = self.main("plan")
+		self.assertEqual(status, 0)
+		self.assertEqual(result["pending"], 3)
+		self.assertEqual(result["pending_bytes"], 9)
+		self.assertEqual(result["already_present"], 1)
+		self.assertIn("eta_seconds", result)
+		(status, result) = self.main("plan", "--limit-to", "02")
+		self.assertEqual((result["pending"], result["already_present"]), (1, 0))
+
+	def test_loadProcessorFromModule(self):
+		module = os.path.join(self.tempdir, "copeconfig_cli_test.py")
+		shutil.copy(self.config, module)
+		sys.path.insert(0, self.tempdir)
+		try:
+			processor = cli.load_processor("copeconfig_cli_test:processor")
+		finally:
+			sys.path.remove(self.tempdir)
+		self.assertEqual(processor.destpath, self.outtree)
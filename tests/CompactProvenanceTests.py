@@ -0,0 +1,107 @@
+import unittest
+import os.path
+import shutil
+import sqlite3
+import tempfile
+from cope.provenancetracker import ProvenanceTracker
+from cope.provenancecompact import CompactProvenanceTracker
+from cope import FileProcessor, Process
+
+class CompactProvenanceTests(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.dbpath = os.path.join(self.tempdir, ".copemetadata/provenance.sqlite")
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_record_and_check(self):
+		rec = CompactProvenanceTracker(self.dbpath)
+		rec.record("in/foo", 1000, "out/bar", 1234, "wibble")
+		rec.record("fpp", 1001, "baz", 1234)
+		rec.record("in/foo", 1235, "out/bar", 1240, "wibble", identity=(1, 2, 3))
+		self.assertEqual(rec.check("in/foo", 1235), "out/bar")
+		self.assertEqual(rec.check("in/foo", 1235, "wibble"), "out/bar")
+		self.assertEqual(rec.check("in/foo", 1235, "blah"), None)
+		self.assertEqual(rec.check("in/foo", 1000), None)
+		self.assertEqual(rec.check("other/foo", 1235), None)
+		self.assertEqual(rec.check("fpp", 1001), "baz")
+		self.assertEqual(rec.most_recently_processed(), "in/foo")
+		self.assertEqual(rec.count(), 2)
+		self.assertEqual([r.inpath for r in rec.lookup_identity((1, 2, 3), 1235)], ["in/foo"])
+		self.assertEqual(rec.lookup_output("out/bar").inmtime, 1235)
+		self.assertEqual(rec.lookup_output("out/baz"), None)
+		self.assertEqual(rec.lookup_output("elsewhere/bar"), None)
+		rec2 = CompactProvenanceTracker(self.dbpath)
+		self.assertEqual(rec2.lookup("in/foo", 1235), ("in/foo", 1235, "out/bar", 1240, "wibble", rec2.lookup("in/foo", 1235).timestamp, None, 1, 2, 3))
+
+	def test_records(self):
+		rec = CompactProvenanceTracker(self.dbpath)
+		for (i, inpath) in enumerate(["EU/DE/Berlin", "EU/DE-old/Bonn", "EU/DE/Hamburg", "EU/FR/Paris", "US/WA/Seattle", "EU/DE/Munich/Pasing", "EU/DE"]):
+			rec.record(inpath, 1, "out/%d"%i, 2, timestamp=1000+i)
+		self.assertEqual([r.inpath for r in rec.records(batch_size=2)], ["EU/DE/Berlin", "EU/DE-old/Bonn", "EU/DE/Hamburg", "EU/FR/Paris", "US/WA/Seattle", "EU/DE/Munich/Pasing", "EU/DE"])
+		self.assertEqual([r.inpath for r in rec.records(inprefix="EU/DE", batch_size=1)], ["EU/DE/Berlin", "EU/DE/Hamburg", "EU/DE/Munich/Pasing", "EU/DE"])
+		self.assertEqual([r.inpath for r in rec.records(inprefix="EU/FR/Paris")], ["EU/FR/Paris"])
+		self.assertEqual([r.inpath for r in rec.records(outpath="out/3")], ["EU/FR/Paris"])
+		self.assertEqual([r.outpath for r in rec.records(since=1001, until=1003)], ["out/1", "out/2"])
+		rec.delete(["out/0", "out/2", "nonexistent/0"])
+		self.assertEqual([r.inpath for r in rec.records(inprefix="EU/DE")], ["EU/DE/Munich/Pasing", "EU/DE"])
+
+	def test_records_ordered(self):
+		"Records ordered by input or output path should each be yielded once, a directory at a time, in order of name within each directory"
+		rec = CompactProvenanceTracker(self.dbpath)
+		for (i, (inpath, outpath)) in enumerate([("b/2", "y/1"), ("a/3", "x/2"), ("b/1", "x/1"), ("a/1", "y/3"), ("b/3", "x/3")]):
+			rec.record(inpath, 1, outpath, 2, timestamp=1000+i)
+		self.assertEqual([r.inpath for r in rec.records(order='inpath', batch_size=2)], ["b/1", "b/2", "b/3", "a/1", "a/3"])
+		self.assertEqual([r.outpath for r in rec.records(order='outpath', batch_size=2)], ["y/1", "y/3", "x/1", "x/2", "x/3"])
+		# as with ProvenanceTracker, records under a prefix come in order of input path by default
+		self.assertEqual([r.inpath for r in rec.records(inprefix="b", batch_size=1)], ["b/1", "b/2", "b/3"])
+		query = rec.dbc.execute("EXPLAIN QUERY PLAN SELECT * FROM oprecord_compact WHERE (indir, inname, rowid) > (1, '', 0) ORDER BY indir, inname, rowid LIMIT 10").fetchall()
+		self.assertFalse(any("TEMP B-TREE" in r[-1] for r in query))
+
+	def test_migrate(self):
+		"A database of records made by ProvenanceTracker should be converted when opened, keeping its records and their order"
+		rec = ProvenanceTracker(self.dbpath)
+		rec.record("a/b/c", 1, "x/c", 2)
+		rec.record("a/d", 3, "d", 4, outsize=10)
+		rec.record("a/b/e", 5, "x/e", 6, identity=(1, 2, 3))
+		rec.dbc.close()
+		rec = CompactProvenanceTracker(self.dbpath)
+		self.assertEqual(rec.check("a/b/c", 1), "x/c")
+		self.assertEqual(rec.lookup("a/d", 3).outsize, 10)
+		self.assertEqual(rec.most_recently_processed(), "a/b/e")
+		self.assertEqual([r.outpath for r in rec.records()], ["x/c", "d", "x/e"])
+		self.assertEqual([r.outpath for r in rec.lookup_identity((1, 2, 3), 5)], ["x/e"])
+		dbc = sqlite3.connect(self.dbpath)
+		self.assertEqual(dbc.execute("select count(*) from sqlite_master where name='oprecord'").fetchone()[0], 0)
+		dbc.close()
+		# the converted database cannot be mistaken for an empty one
+		with self.assertRaises(ValueError):
+			ProvenanceTracker(self.dbpath)
+
+	def test_vacuum(self):
+		"Vacuuming should delete the directories no records refer to, and records should still be made in them afterwards"
+		rec = CompactProvenanceTracker(self.dbpath)
+		rec.record("a/b/c", 1, "x/c", 2)
+		rec.record("a/d/e", 3, "y/e", 4)
+		rec.delete(["y/e"])
+		rec.vacuum()
+		self.assertEqual(sorted(r[0] for r in rec.dbc.execute("select path from directory")), ["a/b", "x"])
+		rec.record("a/d/f", 5, "y/f", 6)
+		self.assertEqual([(r.inpath, r.outpath) for r in rec.records()], [("a/b/c", "x/c"), ("a/d/f", "y/f")])
+
+	def test_fileProcessor(self):
+		intree = os.path.join(self.tempdir, "in")
+		outtree = os.path.join(self.tempdir, "out")
+		for path in ["a", "b/c", "b/d"]:
+			os.makedirs(os.path.dirname(os.path.join(intree, path)), exist_ok=True)
+			with open(os.path.join(intree, path), "w") as f:
+				f.write(path)
+		FileProcessor(intree, outtree, Process.copy).run(max_items=1)
+		proc = FileProcessor(intree, outtree, Process.copy, provenance='compact')
+		log = proc.run()
+		self.assertEqual(log.already_present, [("a", "a")])
+		self.assertEqual(log.processed, [("b/c", "b/c"), ("b/d", "b/d")])
+		log = proc.run()
+		self.assertEqual(len(log.already_present), 3)
@@ -1,10 +1,12 @@
 import unittest
+import functools
 import os.path
 import shutil
 import tempfile
 import time
+from unittest import mock
 
-from cope import FileProcessor, Process, NameMatcher
+from cope import FileProcessor, Process, NameMatcher, CollisionError
 
 class FileProcessorTests(unittest.TestCase):
 
@@ -386,3 +388,520 @@ class FileProcessorTests(unittest.TestCase):
 		self.assertEqual(log.unnameable, [])
 		self.assertEqual(self.contentsOfOutputFile("0120.aa"), "asdfgh")
 		self.assertEqual(self.contentsOfOutputFile("0211.aa"), "oooppp")
+
+	def test_atomicOutputs(self):
+		"""
+		Given a FileProcessor configured with atomic=True
+		When it is run
+		Then the processing function should write to a temporary path, and outputs should be published in batches with their provenance records, leaving nothing for failed files
+		"""
+		self.createInputTree([
+			("01/20.aa", "asdfgh"),
+			("01/21.ab", "qwasds"),
+			("02/11.aa", "oooppp"),
+			("02/12.aa", "zxcvbn"),
+		])
+		written_to = []
+		published = []
+		def process(src, dst):
+			written_to.append(os.path.basename(dst))
+			published.append(sorted(os.listdir(os.path.dirname(dst))))
+			if src.endswith(".ab"):
+				with open(dst, "w") as f:
+					f.write("partial")
+				raise Exception(":-/")
+			shutil.copy(src, dst)
+		proc = FileProcessor(
+			self.intree, 
+			self.outtree, 
+			process,
+			atomic=True,
+			commit_every=2
+		)
+		log = proc.run()
+		self.assertEqual(log.processed, [("01/20.aa", "01/20.aa"), ("02/11.aa", "02/11.aa"), ("02/12.aa", "02/12.aa")])
+		self.assertEqual(len(log.failed), 1)
+		self.assertTrue(all(n.startswith(".cope-tmp-") for n in written_to))
+		# 01/20.aa is not published until the batch is full
+		self.assertEqual(published[1], [".cope-tmp-20.aa"])
+		self.assertEqual(sorted(os.listdir(os.path.join(self.outtree, "01"))), ["20.aa"])
+		self.assertEqual(sorted(os.listdir(os.path.join(self.outtree, "02"))), ["11.aa", "12.aa"])
+		self.assertEqual(self.contentsOfOutputFile("02/12.aa"), "zxcvbn")
+		log2 = proc.run()
+		self.assertEqual(log2.processed, [])
+		self.assertEqual(len(log2.already_present), 3)
+
+	def test_atomicSweepsAfterCrash(self):
+		"""
+		Given temporary files left in the destination by a run which did not finish
+		When a FileProcessor with atomic=True is next opened on it, and then run
+		Then the temporary files should be removed by the run, and nothing else
+		"""
+		self.createInputTree([("01/20.aa", "asdfgh")])
+		markerpath = os.path.join(self.outtree, ".copemetadata", "publishing")
+		FileProcessor(self.intree, self.outtree, Process.copy, atomic=True).run()
+		self.assertEqual(os.path.getsize(markerpath), 0)
+		for path in ["01/.cope-tmp-21.aa", ".cope-tmp-x"]:
+			with open(os.path.join(self.outtree, path), "w") as f:
+				f.write("partial")
+		# after a run which finished, any such files were not left by it, so are left alone
+		FileProcessor(self.intree, self.outtree, Process.copy, atomic=True).run()
+		self.assertTrue(os.path.exists(os.path.join(self.outtree, ".cope-tmp-x")))
+		with open(markerpath, "w") as f:
+			f.write("1")
+		# opening a processor removes nothing; only a run does
+		proc = FileProcessor(self.intree, self.outtree, Process.copy, atomic=True)
+		self.assertTrue(os.path.exists(os.path.join(self.outtree, ".cope-tmp-x")))
+		proc.run()
+		self.assertEqual(sorted(os.listdir(os.path.join(self.outtree, "01"))), ["20.aa"])
+		self.assertFalse(os.path.exists(os.path.join(self.outtree, ".cope-tmp-x")))
+		self.assertEqual(os.path.getsize(markerpath), 0)
+
+	def test_atomicRunInProgress(self):
+		"""
+		Given a FileProcessor with atomic=True part way through a run
+		When another FileProcessor is opened on the same destination, and run
+		Then the second run should be refused, and the first run's temporary files left for it to publish
+		"""
+		self.createInputTree([
+			("01/20.aa", "asdfgh"),
+			("01/21.aa", "qwerty"),
+			("01/22.aa", "zxcvbn"),
+		])
+		errors = []
+		def process(src, dst):
+			shutil.copy(src, dst)
+			if src.endswith("21.aa"):
+				other = FileProcessor(self.intree, self.outtree, Process.copy, atomic=True)
+				other.metadatarepository.product_count()
+				try:
+					other.run()
+				except BlockingIOError as e:
+					errors.append(e)
+		log = FileProcessor(self.intree, self.outtree, process, atomic=True, commit_every=10).run()
+		self.assertEqual(len(errors), 1)
+		self.assertEqual(log.failed, [])
+		self.assertEqual(len(log.processed), 3)
+		self.assertEqual(sorted(os.listdir(os.path.join(self.outtree, "01"))), ["20.aa", "21.aa", "22.aa"])
+		self.assertEqual(self.contentsOfOutputFile("01/22.aa"), "zxcvbn")
+
+	def test_heedMaxBytes(self):
+		"""
+		Given an appropriately configured FileProcessor
+		When it is run with max_bytes specified
+		Then it should stop starting new items once that many bytes of input have been processed
+		"""
+		self.createInputTree([
+			("a", "12345"),
+			("b", "12345"),
+			("c", "12345"),
+		])
+		proc = FileProcessor(self.intree, self.outtree, Process.copy)
+		log1 = proc.run(max_bytes=6)
+		self.assertEqual(log1.processed, [("a", "a"), ("b", "b")])
+		log2 = proc.run(max_bytes=6)
+		self.assertEqual(log2.processed, [("c", "c")])
+
+	def test_heedMaxSeconds(self):
+		"""
+		Given an appropriately configured FileProcessor
+		When it is run with max_seconds specified
+		Then it should stop starting new items once that time has elapsed
+		"""
+		self.createInputTree([
+			("a", ""),
+			("b", ""),
+			("c", ""),
+		])
+		def process(src, dst):
+			time.sleep(0.05)
+			shutil.copy(src, dst)
+		proc = FileProcessor(self.intree, self.outtree, process)
+		log = proc.run(max_seconds=0.01)
+		self.assertEqual(log.processed, [("a", "a")])
+
+	def test_throttle(self):
+		"The throttle should be consulted before each file is processed"
+		self.createInputTree([
+			("a", ""),
+			("b", ""),
+		])
+		waits = []
+		class Throttle:
+			def wait(self):
+				waits.append(1)
+		proc = FileProcessor(self.intree, self.outtree, Process.copy, throttle=Throttle())
+		proc.run()
+		self.assertEqual(len(waits), 2)
+		proc.run()
+		self.assertEqual(len(waits), 2)
+
+	def test_verify(self):
+		"""
+		Given a set of input files previously processed, some of whose outputs have since been deleted or modified
+		When FileProcessor is run with verification
+		Then the files whose outputs are not as recorded should be reprocessed, to the degree of verification specified
+		"""
+		self.createInputTree([
+			("a", "aaa"),
+			("b", "bbb"),
+			("c", "ccc"),
+		])
+		proc = FileProcessor(self.intree, self.outtree, Process.copy)
+		proc.run()
+		os.remove(os.path.join(self.outtree, "a"))
+		st = os.stat(os.path.join(self.outtree, "b"))
+		self.createOutputTree([("b", "truncated")])
+		# keep the modification time, so only the size reveals the change
+		os.utime(os.path.join(self.outtree, "b"), ns=(st.st_atime_ns, st.st_mtime_ns))
+
+		log1 = proc.run()
+		self.assertEqual(log1.processed, [])
+		log2 = proc.run(verify='mtime')
+		self.assertEqual(log2.processed, [("a", "a")])
+		log3 = proc.run(verify='size')
+		self.assertEqual(log3.processed, [("b", "b")])
+		self.assertEqual(self.contentsOfOutputFile("b"), "bbb")
+		log4 = proc.run(verify='size')
+		self.assertEqual(log4.processed, [])
+		self.assertEqual(len(log4.already_present), 3)
+		with self.assertRaises(ValueError):
+			proc.run(verify='hash')
+
+	def test_verify_listsEachDirectoryOnce(self):
+		"""
+		Given a set of input files previously processed, with outputs in more directories than the listings cached, in an order alternating between them
+		When FileProcessor is run with verification
+		Then each output directory should be listed only once
+		"""
+		self.createInputTree([("f%03d"%i, "") for i in range(200)])
+		proc = FileProcessor(self.intree, self.outtree, Process.copy, lambda n: "d%02d/%s"%(int(n[1:]) % 100, n))
+		proc.run()
+		with mock.patch("os.scandir", side_effect=os.scandir) as scandir:
+			log = proc.run(verify='exists')
+		self.assertEqual(len(log.already_present), 200)
+		self.assertEqual(scandir.call_count, 100)
+
+	def test_variadicFunctions(self):
+		"""
+		Given functions taking *args, or partially applied with functools.partial
+		When FileProcessor is run with them, with or without context
+		Then they should be called with all the arguments they accept
+		"""
+		self.createInputTree([("a", "aaa")])
+		def copy(*args, **kw):
+			shutil.copy(*args, **kw)
+		def include(*args):
+			return True
+		def write(prefix, src, dest, ctx=None):
+			with open(src) as fi, open(dest, "w") as fo:
+				fo.write(prefix + fi.read() + (ctx and ctx.header.decode() or ""))
+		for (name, process, context, expected) in [
+			("wrapper", copy, False, "aaa"),
+			("partial", functools.partial(write, "x"), False, "xaaa"),
+			("partial-context", functools.partial(write, "x"), True, "xaaaaaa"),
+		]:
+			outtree = os.path.join(self.tempdir, name)
+			log = FileProcessor(self.intree, outtree, process, includefile=include, context=context).run()
+			self.assertEqual(log.failed, [])
+			with open(os.path.join(outtree, "a")) as f:
+				self.assertEqual(f.read(), expected)
+
+	def test_context(self):
+		"""
+		Given a FileProcessor created with context=True
+		When it is run
+		Then the functions accepting a FileContext should be given the same one for each file, with its header read once
+		"""
+		self.createInputTree([
+			("a", "JPEG:aaa"),
+			("b", "TEXT:bbb"),
+			("c", "JPEG:ccc"),
+		])
+		contexts = []
+		def includefile(path, ctx):
+			contexts.append(ctx)
+			return ctx.header.startswith(b"JPEG")
+		def destname(relpath, path, ctx):
+			ctx.data["name"] = relpath + ".jpg"
+			self.assertEqual(ctx.stat.st_size, 8)
+			return ctx.data["name"]
+		def process(src, dest, ctx):
+			self.assertIs(ctx, contexts[-1])
+			self.assertTrue(dest.endswith(ctx.data["name"]))
+			shutil.copy(src, dest)
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			process,
+			destname,
+			includefile=includefile,
+			context=True,
+			header_size=4
+		)
+		log = proc.run()
+		self.assertEqual(log.processed, [("a", "a.jpg"), ("c", "c.jpg")])
+		self.assertEqual([ctx.header for ctx in contexts], [b"JPEG", b"TEXT", b"JPEG"])
+		# functions not accepting a context are called as before
+		proc = FileProcessor(
+			self.intree,
+			os.path.join(self.tempdir, "out2"),
+			Process.copy,
+			lambda relpath, path: relpath,
+			context=True
+		)
+		self.assertEqual(len(proc.run().processed), 3)
+
+	def test_batchFunctions(self):
+		"""
+		Given a FileProcessor with batch forms of the filtering and naming functions
+		When it is run
+		Then they should each be called once per directory with the files remaining, and their results applied
+		"""
+		self.createInputTree([
+			("01/20.aa", "asdfgh"),
+			("01/21.ab", "qwasds"),
+			("01/22.aa", ""),
+			("02/11.aa", "oooppp"),
+			("02/12.aa", "zxcvbn"),
+		])
+		calls = []
+		def includenames(paths):
+			calls.append(("includenames", paths))
+			return [p for p in paths if p.endswith(".aa")]
+		def includefiles(paths):
+			calls.append(("includefiles", [os.path.relpath(p, self.intree) for p in paths]))
+			return [p for p in paths if os.path.getsize(p) > 0]
+		def destnames(paths):
+			calls.append(("destnames", paths))
+			return [not p.endswith("12.aa") and "".join(p.split("/")) or None for p in paths]
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			Process.copy,
+			includenames=includenames,
+			includefiles=includefiles,
+			destnames=destnames
+		)
+		log = proc.run()
+		self.assertEqual(log.processed, [("01/20.aa", "0120.aa"), ("02/11.aa", "0211.aa")])
+		self.assertEqual(log.unnameable, ["02/12.aa"])
+		self.assertEqual(calls, [
+			("includenames", ["01/20.aa", "01/21.ab", "01/22.aa"]),
+			("includefiles", ["01/20.aa", "01/22.aa"]),
+			("destnames", ["01/20.aa"]),
+			("includenames", ["02/11.aa", "02/12.aa"]),
+			("includefiles", ["02/11.aa", "02/12.aa"]),
+			("destnames", ["02/11.aa", "02/12.aa"]),
+		])
+		# names are only generated for directories with files not already processed
+		calls = []
+		proc.run()
+		self.assertEqual([c[0] for c in calls], ["includenames", "includefiles", "includenames", "includefiles", "destnames"])
+		# and only for the files not already processed
+		self.assertEqual(calls[-1], ("destnames", ["02/12.aa"]))
+
+		# a name must be returned for each file
+		self.createInputTree([("03/01.aa", "x"), ("03/02.aa", "y")])
+		with self.assertRaises(ValueError):
+			FileProcessor(self.intree, self.outtree, Process.copy, destnames=lambda paths: paths[:1]).run()
+
+	def test_timeout(self):
+		"""
+		Given a FileProcessor with a timeout
+		When processing a file takes longer than the timeout
+		Then that file should be logged as timed out, while other files and errors are handled as usual
+		"""
+		self.createInputTree([
+			("a", "a"),
+			("b", "b"),
+			("c", "c"),
+		])
+		def process(src, dst):
+			if src.endswith("b"):
+				time.sleep(30)
+			if src.endswith("c"):
+				raise KeyError(src)
+			shutil.copy(src, dst)
+		progress = []
+		proc = FileProcessor(self.intree, self.outtree, process, timeout=0.5, onprogress=lambda t, s, d: progress.append((t, s)))
+		start = time.time()
+		log = proc.run()
+		self.assertLess(time.time() - start, 10)
+		self.assertEqual(log.processed, [("a", "a")])
+		self.assertEqual([src for (src, e) in log.timed_out], ["b"])
+		self.assertEqual([src for (src, e) in log.failed], ["c"])
+		self.assertIsInstance(log.failed[0][1], KeyError)
+		self.assertIn((FileProcessor.ProgressType.TIMED_OUT, "b"), progress)
+		self.assertFalse(os.path.exists(os.path.join(self.outtree, "b")))
+
+	def test_plan(self):
+		"""
+		Given a partially processed tree
+		When a plan is made
+		Then it should count the files outstanding without naming them
+		"""
+		self.createInputTree([
+			("01/20.aa", "asdfgh"),
+			("01/21.ab", "qwasds"),
+			("02/11.aa", "oooppp\n1"),
+		])
+		names = []
+		def destname(inname):
+			names.append(inname)
+			return inname
+		proc = FileProcessor(self.intree, self.outtree, Process.copy, destname, includename=lambda n: n.endswith(".aa"))
+		proc.run(max_items=1)
+		names = []
+		self.assertEqual(proc.plan(), FileProcessor.Plan(pending=1, pending_bytes=8, already_present=1))
+		self.assertEqual(names, [])
+
+	def test_collisions(self):
+		"""
+		Given input files which are named with the same output path
+		When they are processed with each collision policy
+		Then the collisions should be reported, and handled as the policy dictates, without reprocessing on later runs
+		"""
+		self.createInputTree([
+			("01/20.aa", "first"),
+			("02/20.aa", "second"),
+			("03/21.aa", "third"),
+		])
+		def destname(inname):
+			return os.path.basename(inname)
+		for (policy, processed, outputs) in [
+			("overwrite", [("01/20.aa", "20.aa"), ("02/20.aa", "20.aa"), ("03/21.aa", "21.aa")], {"20.aa": "second"}),
+			("keep-first", [("01/20.aa", "20.aa"), ("03/21.aa", "21.aa")], {"20.aa": "first"}),
+			("suffix", [("01/20.aa", "20.aa"), ("02/20.aa", "20-1.aa"), ("03/21.aa", "21.aa")], {"20.aa": "first", "20-1.aa": "second"}),
+		]:
+			self.outtree = os.path.join(self.tempdir, policy)
+			proc = FileProcessor(self.intree, self.outtree, Process.copy, destname, collisions=policy)
+			log = proc.run()
+			self.assertEqual(log.processed, processed, policy)
+			self.assertEqual(log.collisions, [("02/20.aa", "20.aa", "01/20.aa")], policy)
+			for (path, contents) in outputs.items():
+				self.assertEqual(self.contentsOfOutputFile(path), contents, policy)
+			if policy != "overwrite":
+				log = proc.run()
+				self.assertEqual(log.processed, [], policy)
+		proc = FileProcessor(self.intree, os.path.join(self.tempdir, "fail"), Process.copy, destname, collisions="fail")
+		with self.assertRaises(CollisionError) as raised:
+			proc.run()
+		# the work done before the collision is kept
+		self.assertEqual(raised.exception.result.processed, [("01/20.aa", "20.aa")])
+		self.assertEqual(proc.metadatarepository.get_last_run_stats()["processed"], 1)
+		self.assertEqual(proc.metadatarepository.product_count(), 1)
+		# each file is reported once
+		for policy in ["overwrite", "suffix", "keep-first"]:
+			events = []
+			self.outtree = os.path.join(self.tempdir, "events-" + policy)
+			FileProcessor(self.intree, self.outtree, Process.copy, destname, collisions=policy, onprogress=lambda t, src, dest: events.append(src)).run()
+			self.assertEqual(sorted(events), ["01/20.aa", "02/20.aa", "03/21.aa"], policy)
+		# a suffixed name is not given to an untracked file already there
+		self.outtree = os.path.join(self.tempdir, "suffix-untracked")
+		self.createOutputTree([("20-1.aa", "untracked")])
+		log = FileProcessor(self.intree, self.outtree, Process.copy, destname, collisions="suffix").run()
+		self.assertEqual(log.processed[1], ("02/20.aa", "20-2.aa"))
+		self.assertEqual(self.contentsOfOutputFile("20-1.aa"), "untracked")
+		# once the other input file has gone, its output may be replaced
+		os.unlink(os.path.join(self.intree, "01/20.aa"))
+		self.outtree = os.path.join(self.tempdir, "keep-first")
+		log = FileProcessor(self.intree, self.outtree, Process.copy, destname, collisions="keep-first").run()
+		self.assertEqual(log.processed, [("02/20.aa", "20.aa")])
+		self.assertEqual(log.collisions, [])
+		self.assertEqual(self.contentsOfOutputFile("20.aa"), "second")
+
+	def test_moves(self):
+		"""
+		Given a processed tree
+		When files in it are moved, and it is processed again with each move policy
+		Then the moved files should be recognised and their outputs kept, moved or linked as the policy dictates, rather than processed again
+		"""
+		for policy in ["keep", "rename", "link"]:
+			self.intree = os.path.join(self.tempdir, "in-"+policy)
+			self.outtree = os.path.join(self.tempdir, "out-"+policy)
+			self.createInputTree([
+				("01/20.aa", "asdfgh"),
+				("01/21.aa", "qwerty"),
+			])
+			calls = []
+			def process(src, dst):
+				calls.append(os.path.relpath(src, self.intree))
+				shutil.copy(src, dst)
+			proc = FileProcessor(self.intree, self.outtree, process, lambda n: n.replace("/", "-"), moves=policy)
+			proc.run()
+			os.rename(os.path.join(self.intree, "01"), os.path.join(self.intree, "02"))
+			# a file which is copied rather than moved is not recognised
+			shutil.copy2(os.path.join(self.intree, "02/21.aa"), os.path.join(self.intree, "02/22.aa"))
+			log = proc.run()
+			self.assertEqual(calls, ["01/20.aa", "01/21.aa", "02/22.aa"], policy)
+			target = policy == "keep" and "01-%s.aa" or "02-%s.aa"
+			self.assertEqual(log.moved, [("02/20.aa", target%20, "01/20.aa"), ("02/21.aa", target%21, "01/21.aa")], policy)
+			self.assertEqual(self.contentsOfOutputFile(target%20), "asdfgh", policy)
+			self.assertEqual(os.path.exists(os.path.join(self.outtree, "01-20.aa")), policy != "rename", policy)
+			log = proc.run()
+			self.assertEqual(log.moved, [], policy)
+			self.assertEqual(set(log.already_present), {("02/20.aa", target%20), ("02/21.aa", target%21), ("02/22.aa", "02-22.aa")}, policy)
+
+	def test_moves_recordsWithoutIdentity(self):
+		"""
+		Given a tree processed before the identities of input files were recorded
+		When it is processed again, then a file in it is moved
+		Then the file's identity should have been recorded on the second run, so that its move is recognised
+		"""
+		self.createInputTree([("01/20.aa", "asdfgh")])
+		calls = []
+		def process(src, dst):
+			calls.append(os.path.relpath(src, self.intree))
+			shutil.copy(src, dst)
+		proc = FileProcessor(self.intree, self.outtree, process, lambda n: n.replace("/", "-"), moves="rename")
+		proc.run()
+		tracker = proc.metadatarepository.provenancetracker
+		tracker.dbc.execute("UPDATE oprecord SET indev=NULL, inino=NULL, insize=NULL")
+		tracker.dbc.commit()
+		log = proc.run()
+		self.assertEqual(log.already_present, [("01/20.aa", "01-20.aa")])
+		os.rename(os.path.join(self.intree, "01"), os.path.join(self.intree, "02"))
+		log = proc.run()
+		self.assertEqual(calls, ["01/20.aa"])
+		self.assertEqual(log.moved, [("02/20.aa", "02-20.aa", "01/20.aa")])
+
+	def test_moves_linkedOutputsOrphaned(self):
+		"""
+		Given a processed tree
+		When a file in it is moved, and it is processed again with the 'link' move policy
+		Then the old output should remain in place, recorded as the output of the vanished input, so that it is found as an orphan
+		"""
+		self.createInputTree([("01/20.aa", "asdfgh")])
+		proc = FileProcessor(self.intree, self.outtree, shutil.copy, lambda n: n.replace("/", "-"), moves="link")
+		proc.run()
+		os.rename(os.path.join(self.intree, "01"), os.path.join(self.intree, "02"))
+		log = proc.run()
+		self.assertEqual(log.moved, [("02/20.aa", "02-20.aa", "01/20.aa")])
+		repository = proc.metadatarepository
+		self.assertEqual([r.outpath for r in repository.find_orphans(self.intree)], ["01-20.aa"])
+		self.assertEqual(self.contentsOfOutputFile("01-20.aa"), "asdfgh")
+		self.assertEqual(repository.purge_orphans(self.intree), 1)
+		self.assertEqual([r.outpath for r in repository.provenance_records()], ["02-20.aa"])
+
+	def test_moves_limits(self):
+		"""
+		Given a processed tree
+		When files in it are moved, and it is processed again with max_items or max_dirs
+		Then moved files should count towards the limits
+		"""
+		self.createInputTree([
+			("01/20.aa", "asdfgh"),
+			("01/21.aa", "qwerty"),
+			("03/22.aa", "zxcvbn"),
+		])
+		proc = FileProcessor(self.intree, self.outtree, shutil.copy, lambda n: n.replace("/", "-"), moves="rename")
+		proc.run()
+		os.rename(os.path.join(self.intree, "01"), os.path.join(self.intree, "02"))
+		os.rename(os.path.join(self.intree, "03"), os.path.join(self.intree, "04"))
+		log = proc.run(max_items=1)
+		self.assertEqual([m[0] for m in log.moved], ["02/20.aa"])
+		log = proc.run(max_dirs=1)
+		self.assertEqual([m[0] for m in log.moved], ["02/21.aa"])
+		log = proc.run()
+		self.assertEqual([m[0] for m in log.moved], ["04/22.aa"])
@@ -0,0 +1,66 @@
+import unittest
+import os.path
+import shutil
+import tempfile
+
+from unittest import mock
+
+from cope.metadatarepository import MetadataRepository
+
+class MetadataRepositoryTests(unittest.TestCase):
+
+	def createTree(self, base, files):
+		"""Create a set of files under a directory. The list of files is
+		   a list of (subpath, contents) tuples """
+		for (subpath, contents) in files:
+			path = os.path.join(base, subpath)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "w") as f:
+				f.write(contents)
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.intree = os.path.join(self.tempdir, "in")
+		self.outtree = os.path.join(self.tempdir, "out")
+		os.makedirs(self.intree)
+		os.makedirs(self.outtree)
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_orphans(self):
+		"""
+		Given a provenance database recording some products whose inputs or outputs have since been deleted
+		When orphans are found and purged
+		Then exactly those records should be reported and removed
+		"""
+		self.createTree(self.intree, [("a/1", ""), ("a/2", ""), ("b/3", "")])
+		self.createTree(self.outtree, [("a/1", ""), ("a/2", ""), ("b/4", "")])
+		repo = MetadataRepository(self.outtree)
+		for (inpath, outpath) in [("a/1", "a/1"), ("a/2", "a/2"), ("b/3", "b/3"), ("b/4", "b/4"), ("c/5", "c/5")]:
+			repo.record_product(inpath, 1, outpath, 1)
+
+		self.assertEqual([r.outpath for r in repo.find_orphans()], ["b/3", "c/5"])
+		self.assertEqual([r.outpath for r in repo.find_orphans(self.intree, outputs=False)], ["b/4", "c/5"])
+		self.assertEqual(sorted(r.outpath for r in repo.find_orphans(self.intree)), ["b/3", "b/4", "c/5"])
+		self.assertEqual(repo.purge_orphans(self.intree, batch_size=2), 3)
+		repo.compact()
+		self.assertEqual([r.outpath for r in repo.provenance_records()], ["a/1", "a/2"])
+
+	def test_orphans_list_each_directory_once(self):
+		"""
+		Given records of products in more directories than the listings cached, made in an order alternating between them
+		When orphans are found
+		Then each directory should be listed only once
+		"""
+		dirs = ["d%03d"%i for i in range(100)]
+		self.createTree(self.intree, [("%s/%d"%(d, n), "") for n in range(2) for d in dirs])
+		self.createTree(self.outtree, [("%s/%d"%(d, n), "") for n in range(2) for d in dirs])
+		repo = MetadataRepository(self.outtree)
+		for n in range(2):
+			for d in dirs:
+				repo.record_product("%s/%d"%(d, n), 1, "%s/%d"%(d, n), 1)
+
+		with mock.patch("os.scandir", side_effect=os.scandir) as scandir:
+			self.assertEqual(list(repo.find_orphans(self.intree)), [])
+		self.assertEqual(scandir.call_count, 200)
@@ -2,6 +2,7 @@ import unittest
 import os
 import os.path
 import shutil
+import signal
 import tempfile
 import time
 
@@ -152,4 +153,218 @@ class ProcessFunctionTests(unittest.TestCase):
 		self.assertEqual(log.failed, [])
 		self.assertEqual(self.contentsOfOutputFile("au"), "Sydney\nMelbourne\nBrisbane\nPerth\n")
 		self.assertEqual(os.stat(os.path.join(self.intree, "au")).st_ino, os.stat(os.path.join(self.outtree, "au")).st_ino)
-	
\ No newline at end of file
+	
+	def test_compress(self):
+		"""
+		Given: a set of input files
+		When: a FileProcessor is run with Process.compress, single- or multi-threaded
+		Then: the outputs decompress to the inputs
+		"""
+		import gzip, bz2, lzma
+		contents = "".join("line %d\n"%i for i in range(20000))
+		self.createInputTree([
+			("big", contents),
+			("empty", ""),
+		])
+		for (format, decompress) in [("gzip", gzip.decompress), ("bz2", bz2.decompress), ("lzma", lzma.decompress)]:
+			for threads in [1, 3]:
+				outtree = os.path.join(self.tempdir, "%s-%d"%(format, threads))
+				proc = FileProcessor(
+					self.intree,
+					outtree,
+					Process.compress(format, blocksize=10000, threads=threads)
+				)
+				log = proc.run()
+				self.assertEqual(log.failed, [])
+				for name in ["big", "empty"]:
+					with open(os.path.join(outtree, name), "rb") as f:
+						self.assertEqual(decompress(f.read()).decode(), name == "big" and contents or "")
+		with self.assertRaises(ValueError):
+			Process.compress("rar")
+
+	def test_pipeline(self):
+		"""
+		Given: a set of input files
+		When: a FileProcessor is run with Process.pipeline(...)
+		Then: the input is passed through the stages, and the output of the last is written to the output file
+		"""
+		self.createInputTree([
+			("au", "Sydney\nMelbourne\nBrisbane\nPerth\n"),
+			("is", "Reykjavík\n")
+		])
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			Process.pipeline(["/usr/bin/sort"], ["/usr/bin/head", "-n", "2"])
+		)
+		log = proc.run()
+		self.assertEqual(log.failed, [])
+		self.assertEqual(self.contentsOfOutputFile("au"), "Brisbane\nMelbourne\n")
+		self.assertEqual(self.contentsOfOutputFile("is"), "Reykjavík\n")
+
+		proc = FileProcessor(
+			self.intree,
+			os.path.join(self.tempdir, "out2"),
+			Process.pipeline(["/bin/cat", INFILE], ["/usr/bin/sort", "-o", OUTFILE])
+		)
+		log = proc.run()
+		self.assertEqual(log.failed, [])
+		with open(os.path.join(self.tempdir, "out2", "au")) as f:
+			self.assertEqual(f.read(), "Brisbane\nMelbourne\nPerth\nSydney\n")
+
+	def test_pipeline_earlyExit(self):
+		"""
+		Given: a FileProcessor configured to run a pipeline whose last stage exits before reading all its input
+		When: it is run on a file large enough to fill the pipe
+		Then: the earlier stage being killed by SIGPIPE is not counted as a failure
+		"""
+		self.createInputTree([
+			("test", "".join("%06d\n"%i for i in range(200000, 0, -1)))
+		])
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			Process.pipeline(["sort"], ["head", "-n", "100"])
+		)
+		log = proc.run()
+		self.assertEqual(log.failed, [])
+		self.assertEqual(self.contentsOfOutputFile("test"), "".join("%06d\n"%i for i in range(1, 101)))
+
+	def test_pipeline_reportsFailingStage(self):
+		"""
+		Given: a FileProcessor configured to run a pipeline
+		When: one of its stages returns a nonzero result
+		Then: the file processing is marked as a failure, identifying that stage
+		"""
+		self.createInputTree([
+			("test", "testing")
+		])
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			Process.pipeline(["/bin/cat"], ["/bin/sh", "-c", "cat; exit 3"], ["/bin/cat"])
+		)
+		log = proc.run()
+		self.assertEqual(log.processed, [])
+		self.assertEqual(len(log.failed), 1)
+		error = log.failed[0][1]
+		self.assertEqual(error.stage, 1)
+		self.assertEqual(error.returncode, 3)
+		self.assertEqual(error.returncodes, [0, 3, 0])
+
+	def test_run_interrupted(self):
+		"""
+		Given: a processing function made with Process.run
+		When: waiting for the command is interrupted by an exception
+		Then: the exception is raised, and any processes the command started are killed
+		"""
+		class Interrupted(BaseException):
+			pass
+		def interrupt(signum, frame):
+			raise Interrupted()
+		pidfile = os.path.join(self.tempdir, "pid")
+		process = Process.run("/bin/sh", "-c", "sleep 30 & echo $! > %s; wait" % pidfile)
+		previous = signal.signal(signal.SIGALRM, interrupt)
+		start = time.time()
+		try:
+			signal.setitimer(signal.ITIMER_REAL, 0.5)
+			with self.assertRaises(Interrupted):
+				process(os.path.join(self.intree, "test"), os.path.join(self.outtree, "test"))
+		finally:
+			signal.setitimer(signal.ITIMER_REAL, 0)
+			signal.signal(signal.SIGALRM, previous)
+		self.assertLess(time.time() - start, 10)
+		with open(pidfile) as f:
+			pid = int(f.read())
+		for i in range(50):
+			try:
+				os.kill(pid, 0)
+			except ProcessLookupError:
+				break
+			time.sleep(0.1)
+		else:
+			self.fail("background process was not killed")
+
+	def test_transform(self):
+		"""
+		Given: a set of input files
+		When: a FileProcessor is run with Process.transform, Process.transformChunks or Process.patch
+		Then: the function given is applied to the contents of the files
+		"""
+		self.createInputTree([
+			("au", "Sydney\nMelbourne\nBrisbane\nPerth\n"),
+			("empty", ""),
+		])
+		def reverse(view, fo):
+			fo.write(bytes(view[::-1]))
+		def upper(chunk):
+			return bytes(chunk).upper()
+		def stamp(view):
+			if len(view):
+				view[0:3] = b"XYZ"
+		for (name, process, expected) in [
+			("reverse", Process.transform(reverse), "\nhtreP\nenabsirB\nenruobleM\nyendyS"),
+			("upper", Process.transformChunks(upper, chunksize=5), "SYDNEY\nMELBOURNE\nBRISBANE\nPERTH\n"),
+			("stamp", Process.patch(stamp), "XYZney\nMelbourne\nBrisbane\nPerth\n"),
+		]:
+			outtree = os.path.join(self.tempdir, name)
+			log = FileProcessor(self.intree, outtree, process).run()
+			self.assertEqual(log.failed, [])
+			with open(os.path.join(outtree, "au")) as f:
+				self.assertEqual(f.read(), expected)
+			self.assertEqual(os.path.getsize(os.path.join(outtree, "empty")), 0)
+		with open(os.path.join(self.intree, "au")) as f:
+			self.assertEqual(f.read(), "Sydney\nMelbourne\nBrisbane\nPerth\n")
+
+	def test_transform_keptReference(self):
+		"""
+		Given: a function for Process.transform which keeps a reference to the memoryview it is given
+		When: it raises an exception, or returns normally
+		Then: the file processing fails with that exception, or with a BufferError if it raised none
+		"""
+		self.createInputTree([
+			("test", "testing")
+		])
+		kept = []
+		def failing(view, fo):
+			kept.append(view[1:])
+			raise ValueError("bad input")
+		def keeping(view, fo):
+			kept.append(view[1:])
+		for (name, fn, error) in [("failing", failing, ValueError), ("keeping", keeping, BufferError)]:
+			log = FileProcessor(self.intree, os.path.join(self.tempdir, name), Process.transform(fn)).run()
+			self.assertEqual(len(log.failed), 1)
+			self.assertIsInstance(log.failed[0][1], error)
+		for view in kept:
+			view.release()
+
+	def test_run_timeout(self):
+		"""
+		Given: a FileProcessor configured to run a command with Process.run with a timeout
+		When: the command runs for longer than the timeout
+		Then: the file processing is marked as timed out, and any processes it started are killed
+		"""
+		self.createInputTree([
+			("test", "testing")
+		])
+		pidfile = os.path.join(self.tempdir, "pid")
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			Process.run("/bin/sh", "-c", "sleep 30 & echo $! > %s; wait" % pidfile, timeout=0.5)
+		)
+		start = time.time()
+		log = proc.run()
+		self.assertLess(time.time() - start, 10)
+		self.assertEqual(log.processed, [])
+		self.assertEqual([src for (src, e) in log.timed_out], ["test"])
+		with open(pidfile) as f:
+			pid = int(f.read())
+		for i in range(50):
+			try:
+				os.kill(pid, 0)
+			except ProcessLookupError:
+				break
+			time.sleep(0.1)
+		else:
+			self.fail("background process was not killed")
@@ -0,0 +1,101 @@
+import unittest
+import os
+import os.path
+import shutil
+import tempfile
+
+from cope import FileProcessor, ProductCache
+
+class ProductCacheTests(unittest.TestCase):
+
+	def createTree(self, base, files):
+		for (path, contents) in files:
+			fpath = os.path.join(base, path)
+			os.makedirs(os.path.dirname(fpath), exist_ok=True)
+			with open(fpath, "w") as f:
+				f.write(contents)
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.cachepath = os.path.join(self.tempdir, "cache")
+		self.calls = []
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def upper(self, src, dest):
+		self.calls.append(os.path.basename(src))
+		with open(src) as fi, open(dest, "w") as fo:
+			fo.write(fi.read().upper())
+
+	def contentsOf(self, path):
+		with open(os.path.join(self.tempdir, path)) as f:
+			return f.read()
+
+	def test_sharedBetweenProcessors(self):
+		"""
+		Given two FileProcessors sharing a ProductCache
+		When they process inputs with the same content
+		Then each output should only be generated once
+		"""
+		self.createTree(os.path.join(self.tempdir, "in1"), [("a", "apple"), ("b", "banana"), ("c", "apple")])
+		self.createTree(os.path.join(self.tempdir, "in2"), [("x", "banana"), ("y", "cherry")])
+		cache = ProductCache(self.cachepath, "upper-1")
+		log1 = FileProcessor(os.path.join(self.tempdir, "in1"), os.path.join(self.tempdir, "out1"), self.upper, cache=cache).run()
+		log2 = FileProcessor(os.path.join(self.tempdir, "in2"), os.path.join(self.tempdir, "out2"), self.upper, cache=ProductCache(self.cachepath, "upper-1")).run()
+		self.assertEqual(len(log1.processed), 3)
+		self.assertEqual(len(log2.processed), 2)
+		self.assertEqual(self.calls, ["a", "b", "y"])
+		self.assertEqual(self.contentsOf("out1/c"), "APPLE")
+		self.assertEqual(self.contentsOf("out2/x"), "BANANA")
+		self.assertEqual(self.contentsOf("out2/y"), "CHERRY")
+
+	def test_operationsAreDistinct(self):
+		"""
+		Given a cache holding outputs of one operation
+		When inputs with the same content are processed with another operation
+		Then the outputs of the first should not be used
+		"""
+		self.createTree(os.path.join(self.tempdir, "in"), [("a", "apple")])
+		FileProcessor(os.path.join(self.tempdir, "in"), os.path.join(self.tempdir, "out1"), self.upper, cache=ProductCache(self.cachepath, "upper-1")).run()
+		FileProcessor(os.path.join(self.tempdir, "in"), os.path.join(self.tempdir, "out2"), self.upper, cache=ProductCache(self.cachepath, "upper-2")).run()
+		self.assertEqual(self.calls, ["a", "a"])
+
+	def test_eviction(self):
+		"""
+		Given a cache with a maximum size
+		When more outputs are stored than fit
+		Then the least recently used should be evicted
+		"""
+		sources = os.path.join(self.tempdir, "src")
+		self.createTree(sources, [("a", "a"*10), ("b", "b"*10), ("c", "c"*10), ("out", "")])
+		cache = ProductCache(self.cachepath, "copy", max_size=25)
+		cache.store("a", os.path.join(sources, "a"))
+		cache.store("b", os.path.join(sources, "b"))
+		self.assertTrue(cache.fetch("a", os.path.join(sources, "out")))
+		cache.store("c", os.path.join(sources, "c"))
+		self.assertEqual(cache.size(), 20)
+		self.assertFalse(cache.fetch("b", os.path.join(sources, "out")))
+		self.assertTrue(cache.fetch("c", os.path.join(sources, "out")))
+		self.assertEqual(self.contentsOf("src/out"), "c"*10)
+		self.assertEqual(len([f for (d, ds, fs) in os.walk(cache.objectspath) for f in fs]), 2)
+
+	def test_cachedOutputsNotModified(self):
+		"""
+		Given an output materialised from the cache
+		When it is generated again
+		Then the cached output should be unchanged
+		"""
+		intree = os.path.join(self.tempdir, "in")
+		self.createTree(intree, [("a", "apple"), ("b", "apple")])
+		proc = FileProcessor(intree, os.path.join(self.tempdir, "out"), self.upper, cache=ProductCache(self.cachepath, "upper-1"))
+		proc.run()
+		self.createTree(intree, [("a", "avocado")])
+		os.utime(os.path.join(intree, "a"), (0, 0))
+		proc.run()
+		self.assertEqual(self.contentsOf("out/a"), "AVOCADO")
+		self.assertEqual(self.contentsOf("out/b"), "APPLE")
+		self.createTree(intree, [("c", "apple")])
+		proc.run()
+		self.assertEqual(self.contentsOf("out/c"), "APPLE")
+		self.assertEqual(self.calls, ["a", "a"])
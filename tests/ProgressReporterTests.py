@@ -0,0 +1,116 @@
+import unittest
+import os.path
+import shutil
+import tempfile
+
+from cope import FileProcessor, Process, ProgressReporter
+
+class ProgressReporterTests(unittest.TestCase):
+
+	def createTree(self, base, files):
+		"""Create a set of files under a directory. The list of files is
+		   a list of (subpath, contents) tuples """
+		for (subpath, contents) in files:
+			path = os.path.join(base, subpath)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "w") as f:
+				f.write(contents)
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.intree = os.path.join(self.tempdir, "in")
+		self.outtree = os.path.join(self.tempdir, "out")
+		os.makedirs(self.intree)
+		os.makedirs(self.outtree)
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_reporting(self):
+		"""
+		Given a FileProcessor with a ProgressReporter as its onprogress function
+		When it is run
+		Then all events should have been passed on by the end of the run, and a final summary given
+		"""
+		self.createTree(self.intree, [
+			("01/20.aa", "asdfgh"),
+			("01/21.ab", "qwasds"),
+			("02/11.aa", "ooo"),
+		])
+		events = []
+		summaries = []
+		reporter = ProgressReporter(onprogress=lambda *args: events.append(args), onsummary=summaries.append)
+		proc = FileProcessor(
+			self.intree,
+			self.outtree,
+			Process.copy,
+			lambda n: n.endswith(".aa") and n,
+			onprogress=reporter
+		)
+		proc.run()
+		self.assertEqual(events, [
+			(FileProcessor.ProgressType.PROCESSED, "01/20.aa", "01/20.aa", 6),
+			(FileProcessor.ProgressType.UNNAMEABLE, "01/21.ab", None, 6),
+			(FileProcessor.ProgressType.PROCESSED, "02/11.aa", "02/11.aa", 3),
+		])
+		summary = summaries[-1]
+		self.assertEqual(summary.files, 3)
+		self.assertEqual(summary.bytes, 9)
+		self.assertEqual(summary.counts[FileProcessor.ProgressType.PROCESSED], 2)
+		self.assertEqual(summary.eta, None)
+
+		# the second run expects as many files as the first handled
+		self.createTree(self.intree, [("03/01.aa", "x")])
+		proc.run()
+		self.assertEqual(reporter.expected, 3)
+		summary = summaries[-1]
+		self.assertEqual(summary.files, 4)
+		self.assertEqual(summary.counts[FileProcessor.ProgressType.ALREADY_PRESENT], 2)
+		self.assertEqual(summary.eta, 0)
+
+	def test_failingCallback(self):
+		"""
+		Given a ProgressReporter whose onprogress function raises an exception for one event
+		When more events than its queue holds are reported, and it is flushed
+		Then the other events should still be handled, and the exception kept as its error
+		"""
+		events = []
+		def onprogress(progresstype, src, dest, size):
+			if src == "1":
+				raise ValueError("bad event")
+			events.append(src)
+		reporter = ProgressReporter(onprogress=onprogress, queue_size=2, batch_size=1)
+		for i in range(10):
+			reporter(FileProcessor.ProgressType.PROCESSED, str(i), str(i), 1)
+		reporter.flush()
+		self.assertEqual(len(events), 9)
+		self.assertIsInstance(reporter.error, ValueError)
+
+	def test_failingCallbackInRun(self):
+		"""
+		Given a FileProcessor with a ProgressReporter whose onprogress function raises an exception
+		When it is run
+		Then the run should complete and save its statistics, and the exception be kept as the reporter's error until the next run
+		"""
+		self.createTree(self.intree, [("01/20.aa", "asdfgh")])
+		def onprogress(progresstype, src, dest, size):
+			raise ValueError("bad event")
+		reporter = ProgressReporter(onprogress=onprogress)
+		proc = FileProcessor(self.intree, self.outtree, Process.copy, onprogress=reporter)
+		log = proc.run()
+		self.assertEqual(log.processed, [("01/20.aa", "01/20.aa")])
+		self.assertEqual(proc.metadatarepository.get_last_run_stats()["processed"], 1)
+		self.assertIsInstance(reporter.error, ValueError)
+		reporter.onprogress = None
+		proc.run()
+		self.assertIsNone(reporter.error)
+
+	def test_eta(self):
+		reporter = ProgressReporter(expected=10)
+		for i in range(4):
+			reporter(FileProcessor.ProgressType.PROCESSED, "f%d"%i, "f%d"%i, 100)
+		reporter.flush()
+		summary = reporter.summary()
+		self.assertEqual((summary.files, summary.bytes), (4, 400))
+		self.assertTrue(summary.files_per_second > 0)
+		self.assertAlmostEqual(summary.eta, 6/summary.files_per_second)
@@ -0,0 +1,73 @@
+import unittest
+import os.path
+import shutil
+import tempfile
+from cope.provenancelog import LogProvenanceTracker
+from cope import FileProcessor, Process
+
+class ProvenanceLogTests(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.logpath = os.path.join(self.tempdir, ".copemetadata/provenance.log")
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_record_and_check(self):
+		rec = LogProvenanceTracker(self.logpath)
+		rec.record("/in/foo", 1000, "/out/bar", 1234, "wibble")
+		rec.record("/in/fpp", 1001, "/out/baz", 1234)
+		rec.record("/in/foo", 1235, "/out/bar", 1240, "wibble")
+		self.assertEqual(rec.check("/in/foo", 1235), "/out/bar")
+		self.assertEqual(rec.check("/in/foo", 1235, "wibble"), "/out/bar")
+		self.assertEqual(rec.check("/in/foo", 1235, "blah"), None)
+		self.assertEqual(rec.check("/in/foo", 1000), None)
+		self.assertEqual(rec.most_recently_processed(), "/in/foo")
+		self.assertEqual([(r.inpath, r.inmtime) for r in rec.records()], [("/in/fpp", 1001), ("/in/foo", 1235)])
+
+	def test_lookup_identity(self):
+		rec = LogProvenanceTracker(self.logpath)
+		rec.record("/in/foo", 1000, "/out/foo", 1234, identity=(1, 2, 3))
+		rec.record("/in/bar", 1000, "/out/bar", 1234, identity=(1, 4, 3))
+		rec.record("/in/baz", 1000, "/out/baz", 1234)
+		rec2 = LogProvenanceTracker(self.logpath)
+		self.assertEqual([r.inpath for r in rec2.lookup_identity((1, 2, 3), 1000)], ["/in/foo"])
+		self.assertEqual(rec2.lookup_identity((1, 2, 3), 1001), [])
+		self.assertEqual(rec2.lookup_identity((1, 2, 4), 1000), [])
+		rec2.delete(["/out/foo"])
+		self.assertEqual(rec2.lookup_identity((1, 2, 3), 1000), [])
+
+	def test_reopen(self):
+		"Records should survive reopening, whether in the log or the snapshot, and an incomplete last line should be ignored"
+		rec = LogProvenanceTracker(self.logpath, compact_every=3)
+		for i in range(5):
+			rec.record("/in/%d"%i, i, "/out/%d"%i, i)
+		rec.delete(["/out/0"])
+		rec.record("/in/5", 5, "/out/5", 5, commit=False)
+		rec.commit()
+		with open(self.logpath, "a") as f:
+			f.write('{"r": ["/in/6", 6, "/ou')
+		rec2 = LogProvenanceTracker(self.logpath, compact_every=3)
+		self.assertEqual([r.inpath for r in rec2.records()], ["/in/1", "/in/2", "/in/3", "/in/4", "/in/5"])
+		self.assertEqual(rec2.check("/in/3", 3), "/out/3")
+		self.assertEqual(rec2.most_recently_processed(), "/in/5")
+		self.assertTrue(os.path.isfile(os.path.join(self.tempdir, ".copemetadata/provenance.snapshot")))
+		rec2.record("/in/7", 7, "/out/7", 7)
+		rec3 = LogProvenanceTracker(self.logpath)
+		self.assertEqual(rec3.check("/in/7", 7), "/out/7")
+
+	def test_fileProcessor(self):
+		intree = os.path.join(self.tempdir, "in")
+		outtree = os.path.join(self.tempdir, "out")
+		os.makedirs(intree)
+		for name in ["a", "b"]:
+			with open(os.path.join(intree, name), "w") as f:
+				f.write(name)
+		log1 = FileProcessor(intree, outtree, Process.copy, provenance='log').run()
+		self.assertEqual(log1.processed, [("a", "a"), ("b", "b")])
+		self.assertTrue(os.path.isfile(os.path.join(outtree, ".copemetadata/provenance.log")))
+		log2 = FileProcessor(intree, outtree, Process.copy, provenance='log').run()
+		self.assertEqual(log2.already_present, [("a", "a"), ("b", "b")])
+		with self.assertRaises(ValueError):
+			FileProcessor(intree, outtree, Process.copy, provenance='csv')
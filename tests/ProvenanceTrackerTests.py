@@ -32,7 +32,7 @@ class ProvenanceTrackerTests(unittest.TestCase):
 	def db_insert_oprecord(self, values):
 		dbc = self.db_open()
 		cur = dbc.cursor()
-		cur.executemany("insert into oprecord values (?,?,?,?,?,?)", values)
+		cur.executemany("insert into oprecord (inpath, inmtime, outpath, outmtime, opname, timestamp) values (?,?,?,?,?,?)", values)
 		dbc.commit()
 		
 
@@ -91,3 +91,58 @@ class ProvenanceTrackerTests(unittest.TestCase):
 		self.assertFalse(rec.check("/in/1000-1999/f1023.data", 1027, "blah"))
 		# return false if matching a specific operation name but the record does not have one
 		self.assertFalse(rec.check("/in/1000-1999/f1024.data", 1029, "wibble"))
+
+	def test_records(self):
+		rec=ProvenanceTracker(os.path.join(self.tempdir, ".copemetadata/provenance.sqlite"))
+		self.db_insert_oprecord([
+			("EU/DE/Berlin", 1, "out/1", 2, None, 1000),
+			("EU/DE-old/Bonn", 1, "out/2", 2, None, 1001),
+			("EU/DE/Hamburg", 1, "out/3", 2, None, 1002),
+			("EU/FR/Paris", 1, "out/4", 2, None, 1003),
+			("US/WA/Seattle", 1, "out/5", 2, None, 1004),
+		])
+		# fetch in small batches, to exercise continuing from one batch to the next
+		self.assertEqual([r.inpath for r in rec.records(batch_size=2)], ["EU/DE/Berlin", "EU/DE-old/Bonn", "EU/DE/Hamburg", "EU/FR/Paris", "US/WA/Seattle"])
+		self.assertEqual([r.inpath for r in rec.records(inprefix="EU/DE", batch_size=1)], ["EU/DE/Berlin", "EU/DE/Hamburg"])
+		self.assertEqual([r.inpath for r in rec.records(inprefix="EU/", batch_size=2)], ["EU/DE-old/Bonn", "EU/DE/Berlin", "EU/DE/Hamburg", "EU/FR/Paris"])
+		self.assertEqual([r.inpath for r in rec.records(inprefix="EU/FR/Paris")], ["EU/FR/Paris"])
+		self.assertEqual(list(rec.records(outpath="out/3")), [("EU/DE/Hamburg", 1, "out/3", 2, None, 1002, None, None, None, None)])
+		self.assertEqual([r.outpath for r in rec.records(since=1001, until=1003)], ["out/2", "out/3"])
+
+	def test_delete(self):
+		rec=ProvenanceTracker(os.path.join(self.tempdir, ".copemetadata/provenance.sqlite"))
+		rec.record("/in/foo", 1000, "/out/foo", 1234)
+		rec.record("/in/bar", 1000, "/out/bar", 1234)
+		rec.record("/in/baz", 1000, "/out/baz", 1234)
+		rec.delete(["/out/foo", "/out/baz"])
+		self.assertEqual(self.db_query("select outpath from oprecord"), [("/out/bar",)])
+
+	def test_lookup_identity(self):
+		rec=ProvenanceTracker(os.path.join(self.tempdir, ".copemetadata/provenance.sqlite"))
+		rec.record("/in/foo", 1000, "/out/foo", 1234, identity=(1, 2, 3))
+		rec.record("/in/bar", 1000, "/out/bar", 1234, identity=(1, 4, 3))
+		rec.record("/in/baz", 1000, "/out/baz", 1234)
+		self.assertEqual([r.inpath for r in rec.lookup_identity((1, 2, 3), 1000)], ["/in/foo"])
+		self.assertEqual(rec.lookup_identity((1, 2, 3), 1001), [])
+		self.assertEqual(rec.lookup_identity((1, 2, 4), 1000), [])
+
+	def test_lookup_output(self):
+		rec=ProvenanceTracker(os.path.join(self.tempdir, ".copemetadata/provenance.sqlite"))
+		rec.record("/in/foo", 1000, "/out/foo", 1234)
+		rec.record("/in/foo", 1001, "/out/foo", 1235)
+		self.assertEqual(rec.lookup_output("/out/foo").inmtime, 1001)
+		self.assertEqual(rec.lookup_output("/out/bar"), None)
+
+	def test_upgrade_schema(self):
+		"A database created with the original columns should have the later ones added when opened"
+		dbpath = os.path.join(self.tempdir, ".copemetadata/provenance.sqlite")
+		os.makedirs(os.path.dirname(dbpath))
+		dbc = sqlite3.connect(dbpath)
+		dbc.execute("create table oprecord (inpath VARCHAR, inmtime INT, outpath VARCHAR PRIMARY KEY, outmtime INT, opname VARCHAR, timestamp INT)")
+		dbc.execute("insert into oprecord values ('/in/foo', 1000, '/out/bar', 1234, NULL, 2222)")
+		dbc.commit()
+		dbc.close()
+		rec=ProvenanceTracker(dbpath)
+		self.assertEqual(rec.lookup("/in/foo", 1000), ("/in/foo", 1000, "/out/bar", 1234, None, 2222, None, None, None, None))
+		rec.record("/in/foo", 1001, "/out/bar", 1235, outsize=10)
+		self.assertEqual(rec.lookup("/in/foo", 1001).outsize, 10)
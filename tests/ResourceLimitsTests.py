@@ -0,0 +1,68 @@
+import unittest
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+
+from cope import FileProcessor, Process, ResourceLimits, OUTFILE
+
+REPORT = "import os, resource; print(os.getpriority(os.PRIO_PROCESS, 0), sorted(os.sched_getaffinity(0))[0], resource.getrlimit(resource.RLIMIT_CPU)[0])"
+
+class ResourceLimitsTests(unittest.TestCase):
+
+	def setUp(self):
+		if os.getpriority(os.PRIO_PROCESS, 0) > 14:
+			self.skipTest("already running at low priority")
+		self.tempdir = tempfile.mkdtemp()
+		self.intree = os.path.join(self.tempdir, "in")
+		self.outtree = os.path.join(self.tempdir, "out")
+		os.makedirs(self.intree)
+		with open(os.path.join(self.intree, "a"), "w") as f:
+			f.write("a")
+		self.limits = ResourceLimits(nice=os.getpriority(os.PRIO_PROCESS, 0) + 5, ioclass='idle', cpus={0}, cpu_time=600)
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def contentsOfOutputFile(self, path):
+		with open(os.path.join(self.outtree, path)) as f:
+			return f.read()
+
+	def test_invalidIOClass(self):
+		with self.assertRaises(ValueError):
+			ResourceLimits(ioclass='fastest')
+
+	def test_processHelpers(self):
+		"""
+		Given: process helpers with resource limits
+		When: they run external processes
+		Then: the limits should be applied to those processes
+		"""
+		expected = "%d 0 600\n"%self.limits.nice
+		for (name, process) in [
+			("run", Process.run("/bin/sh", "-c", 'exec "$0" -c "$1" > "$2"', sys.executable, REPORT, OUTFILE, limits=self.limits)),
+			("captureOutputOf", Process.captureOutputOf(sys.executable, "-c", REPORT, limits=self.limits)),
+			("pipeline", Process.pipeline([sys.executable, "-c", REPORT], ["cat"], limits=self.limits)),
+		]:
+			outtree = os.path.join(self.tempdir, name)
+			log = FileProcessor(self.intree, outtree, process).run()
+			self.assertEqual(log.failed, [], name)
+			with open(os.path.join(outtree, "a")) as f:
+				self.assertEqual(f.read(), expected, name)
+		# the limits are not applied to this process
+		self.assertNotEqual(os.getpriority(os.PRIO_PROCESS, 0), self.limits.nice)
+
+	def test_fileProcessor(self):
+		"""
+		Given: a FileProcessor with resource limits
+		When: it is run
+		Then: the processing function should be called with the limits applied
+		"""
+		def process(src, dest):
+			with open(dest, "w") as f:
+				f.write("%d %s"%(os.getpriority(os.PRIO_PROCESS, 0), sorted(os.sched_getaffinity(0))))
+		log = FileProcessor(self.intree, self.outtree, process, limits=self.limits).run()
+		self.assertEqual(log.processed, [("a", "a")])
+		self.assertEqual(self.contentsOfOutputFile("a"), "%d [0]"%self.limits.nice)
+		self.assertNotEqual(os.getpriority(os.PRIO_PROCESS, 0), self.limits.nice)
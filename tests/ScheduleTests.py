@@ -0,0 +1,95 @@
+import unittest
+import os
+import os.path
+import shutil
+import tempfile
+
+from cope import FileProcessor, Process, Schedule
+from cope.iterators.directorytree import DirectoryTreeIterator
+
+class ScheduleTests(unittest.TestCase):
+
+	def createTree(self, base, files):
+		"""Create a set of files under a directory. The list of files is
+		   a list of (subpath, contents) tuples """
+		for (subpath, contents) in files:
+			path = os.path.join(base, subpath)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "w") as f:
+				f.write(contents)
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_newestFirst(self):
+		self.createTree(self.tempdir, [("a", ""), ("b/c", ""), ("d", "")])
+		for (name, mtime) in [("a", 3000), ("b/c", 1000), ("d", 2000)]:
+			os.utime(os.path.join(self.tempdir, name), (mtime, mtime))
+		iter = Schedule.newestFirst()(DirectoryTreeIterator())
+		self.assertEqual(list(iter(self.tempdir)), ["a", "d", "b/c"])
+		# with a window of 2, "a" is yielded before "d" has been seen
+		iter = Schedule.newestFirst(window=2)(DirectoryTreeIterator())
+		self.assertEqual(list(iter(self.tempdir)), ["a", "d", "b/c"])
+		os.utime(os.path.join(self.tempdir, "d"), (4000, 4000))
+		self.assertEqual(list(iter(self.tempdir)), ["a", "d", "b/c"])
+
+	def test_newestFirstWindow(self):
+		"""
+		Given files whose modification times run from oldest to newest in traversal order
+		When they are scheduled newest first over the whole tree, and within a window of 2
+		Then the whole tree should be in order, but within the window the oldest file should only be held back by one place
+		"""
+		self.createTree(self.tempdir, [("a", ""), ("b", ""), ("c", "")])
+		for (name, mtime) in [("a", 1000), ("b", 2000), ("c", 3000)]:
+			os.utime(os.path.join(self.tempdir, name), (mtime, mtime))
+		iter = Schedule.newestFirst(window=None)(DirectoryTreeIterator())
+		self.assertEqual(list(iter(self.tempdir)), ["c", "b", "a"])
+		iter = Schedule.newestFirst(window=2)(DirectoryTreeIterator())
+		self.assertEqual(list(iter(self.tempdir)), ["b", "c", "a"])
+
+	def test_smallestFirst(self):
+		self.createTree(self.tempdir, [("a", "xxx"), ("b/c", ""), ("d", "x")])
+		iter = Schedule.smallestFirst()(DirectoryTreeIterator())
+		self.assertEqual(list(iter(self.tempdir)), ["b/c", "d", "a"])
+
+	def test_fairShare(self):
+		self.createTree(self.tempdir, [
+			("big/1", ""), ("big/2", ""), ("big/3", ""), ("big/4", ""),
+			("small/1", ""),
+			("top", ""),
+			("x/y/1", ""), ("x/y/2", ""),
+		])
+		iter = Schedule.fairShare()(DirectoryTreeIterator())
+		self.assertEqual(list(iter(self.tempdir)), ["top", "big/1", "small/1", "x/y/1", "big/2", "x/y/2", "big/3", "big/4"])
+		self.assertEqual(list(iter(self.tempdir, limit_to="x")), ["x/y/1", "x/y/2"])
+		# directories the iterator excludes are not visited
+		iter = Schedule.fairShare()(DirectoryTreeIterator(include_dir=lambda d: d != "big"))
+		self.assertEqual(list(iter(self.tempdir)), ["top", "small/1", "x/y/1", "x/y/2"])
+
+	def test_fairShareTopLevelFiles(self):
+		"""
+		Given a tree with many files at its top level
+		When they are scheduled fairly
+		Then the top level should be listed only once
+		"""
+		self.createTree(self.tempdir, [("f%03d"%i, "") for i in range(100)] + [("d/1", "")])
+		listed = []
+		def iterator(path, **kw):
+			listed.append(kw)
+			return DirectoryTreeIterator()(path, **kw)
+		iter = Schedule.fairShare()(iterator)
+		self.assertEqual(list(iter(self.tempdir))[:3], ["f000", "d/1", "f001"])
+		self.assertEqual(listed, [{"limit_to": "d"}])
+
+	def test_fileProcessorWithSchedule(self):
+		intree = os.path.join(self.tempdir, "in")
+		outtree = os.path.join(self.tempdir, "out")
+		self.createTree(intree, [("a/1", ""), ("a/2", ""), ("a/3", ""), ("b/1", "")])
+		proc = FileProcessor(intree, outtree, Process.copy, schedule=Schedule.fairShare())
+		log = proc.run(max_items=2)
+		self.assertEqual(log.processed, [("a/1", "a/1"), ("b/1", "b/1")])
+		with self.assertRaises(ValueError):
+			proc.run(resume=True)
@@ -0,0 +1,34 @@
+import unittest
+
+from cope import PressureThrottle
+
+class ThrottleTests(unittest.TestCase):
+
+	class StubThrottle(PressureThrottle):
+		"A throttle reading pressure from a list of values, rather than from the system"
+		def __init__(self, readings, **kw):
+			PressureThrottle.__init__(self, **kw)
+			self.readings = readings
+		def pressure(self):
+			return self.readings.pop(0)
+
+	def test_overloaded(self):
+		throttle = ThrottleTests.StubThrottle([5.0, 25.0], max_pressure=20.0)
+		self.assertFalse(throttle.overloaded())
+		self.assertTrue(throttle.overloaded())
+
+	def test_wait(self):
+		throttle = ThrottleTests.StubThrottle([50.0, 50.0, 0.0], max_pressure=20.0, min_delay=0.001, check_interval=60)
+		throttle.wait()
+		self.assertEqual(throttle.readings, [])
+		# within the check interval, the pressure is not examined again
+		throttle.wait()
+
+	def test_max_wait(self):
+		throttle = ThrottleTests.StubThrottle([50.0]*100, min_delay=0.001, max_wait=0.01)
+		throttle.wait()
+		self.assertTrue(len(throttle.readings) > 0)
+
+	def test_pressure(self):
+		pressure = PressureThrottle().pressure()
+		self.assertTrue(pressure is None or pressure >= 0)
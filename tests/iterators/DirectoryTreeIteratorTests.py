@@ -3,7 +3,7 @@ import tempfile
 import os.path
 import shutil
 
-from cope.iterators.directorytree import DirectoryTreeIterator
+from cope.iterators.directorytree import DirectoryTreeIterator, ConcurrentDirectoryTreeIterator
 
 class DirectoryTreeIteratorTests(unittest.TestCase):
 
@@ -109,3 +109,28 @@ class DirectoryTreeIteratorTests(unittest.TestCase):
 			[i for i in DirectoryTreeIterator()(self.tempdir, limit_to="EU/FR")],
 			["EU/FR/Paris"]
 		)
+
+	def test_concurrent_matches_serial(self):
+		"The concurrent iterator should yield the same paths in the same order as the serial one"
+		self.createTree(self.tempdir, [
+			("Australia/NSW/Newcastle", ""),
+			("Australia/NSW/Sydney", ""),
+			("Australia/VIC/Ballarat", ""),
+			("Australia/VIC/Melbourne", ""),
+			("Australia/index", ""),
+			("EU/DE/Berlin", ""),
+			("EU/DE/Hamburg", ""),
+			("EU/ES/Madrid", ""),
+			("EU/FR/Paris", ""),
+			("US/CA/San Francisco", ""),
+			("US/WA/Seattle", ""),
+			(".hidden/foo", ""),
+			("b", "")
+		])
+		include_dir = lambda s:s[0] != '.'
+		serial = DirectoryTreeIterator(include_dir=include_dir)
+		# a small prefetch limit exercises listing on demand as well as ahead of time
+		for concurrent in [ConcurrentDirectoryTreeIterator(include_dir=include_dir), ConcurrentDirectoryTreeIterator(include_dir=include_dir, concurrency=2, prefetch=1)]:
+			self.assertEqual(list(concurrent(self.tempdir)), list(serial(self.tempdir)))
+			for kw in [{"start": "EU/DE/Hamburg"}, {"stop": "EU/ES"}, {"limit_to": "Australia/VIC"}, {"limit_to": "b"}]:
+				self.assertEqual(list(concurrent(self.tempdir, **kw)), list(serial(self.tempdir, **kw)))
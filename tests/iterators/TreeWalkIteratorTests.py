@@ -53,3 +53,49 @@ class TreeWalkIteratorTests(unittest.TestCase):
 		self.assertEqual(len(iterated), 4)
 		self.assertEqual(len(set([os.path.dirname(f) for f in iterated])), 2)
 
+
+	def test_order(self):
+		"Files in a directory should be yielded in sorted order, before those in its subdirectories"
+		self.createTree(self.tempdir, [
+			("b/d/x", ''),
+			("b/c/x", ''),
+			("b/z", ''),
+			("a/x", ''),
+			("y", ''),
+		])
+		iterated = list(TreeWalkIterator()(self.tempdir))
+		self.assertEqual(iterated, ["y", "a/x", "b/z", "b/c/x", "b/d/x"])
+
+	def test_prune(self):
+		"Excluded directories should not be descended into, nor counted against max_dirs"
+		self.createTree(self.tempdir, [
+			("a/b/c/x", ''),
+			("a/x", ''),
+			("b/x", ''),
+			("c/x", ''),
+		])
+		seen = []
+		def include_dir(d):
+			seen.append(d)
+			return d != "a"
+		iterated = list(TreeWalkIterator(include_dir=include_dir, max_dirs=1)(self.tempdir))
+		self.assertEqual(iterated, ["b/x"])
+		self.assertNotIn("a/b", seen)
+
+	def test_start_stop(self):
+		"Ensure that start, stop and limit_to select the files between them, in the order yielded"
+		self.createTree(self.tempdir, [
+			("a/x", ''),
+			("a/b/x", ''),
+			("a/b/y", ''),
+			("a/c/x", ''),
+			("b/x", ''),
+			("z", ''),
+		])
+		walk = TreeWalkIterator()
+		self.assertEqual(list(walk(self.tempdir, start="a/b/y")), ["a/b/y", "a/c/x", "b/x"])
+		self.assertEqual(list(walk(self.tempdir, start="a/b")), ["a/b/x", "a/b/y", "a/c/x", "b/x"])
+		self.assertEqual(list(walk(self.tempdir, stop="a/b/x")), ["z", "a/x", "a/b/x"])
+		self.assertEqual(list(walk(self.tempdir, start="a/x", stop="a/b")), ["a/x", "a/b/x", "a/b/y"])
+		self.assertEqual(list(walk(self.tempdir, limit_to="a/b")), ["a/b/x", "a/b/y"])
+		self.assertEqual(list(walk(self.tempdir, limit_to="a")), ["a/x", "a/b/x", "a/b/y", "a/c/x"])